@@ -6,30 +6,64 @@ Created on Tue Mar 24 00:55:01 2020
 @author: wenqianchen
 """
 import sys
+import zlib
 sys.path.insert(0,'../tools')
 sys.path.insert(0,'../tools/NNs')
 
 from Net1Dburges import CustomedEqs, CustomedNet 
 from Normalization import Normalization
-from NN import train, DEVICE, train_options_default
+from NN import train, DEVICE, train_options_default, Finished
+from Collocation import Resampler
+from Samplers import Samples
+from Parallel import Rank
+from Scheduler import Sweep
+from Cache import ResultCache, CaseKey, SourceDigest
+from Checkpoint import RNGState, SetRNGState, Seed
 import numpy as np
+import torch
 
 #
 EPOCH   = int(2E4)
 train_options_default['lamda'] = lambda epoch: 0.96**(epoch//200)
+# early stopping of the sweep: no improvement in patience epochs from epoch
+# stop_start on (off in train_options_default)
+train_options_default.update(patience=500, stop_start=1000)
 NumSolsdir = 'NumSols'
 resultsdir = 'results'
+# adaptive collocation of the Resi/Hybrid nets, e.g. {'mode':'RAD', 'epoch':500}
+RESAMPLE   = None
+# residual points: random, sobol, halton, lhs or smolyak, see Samplers (opt-in:
+# the reference sweep draws uniform random points)
+SAMPLER    = 'random'
+# early stopping on GetError of VALIDATE validation cases (0: on the test loss)
+VALIDATE   = 0
+# continue an interrupted case from its netfile.state, see train (opt-in: a
+# stale state of another configuration would be continued)
+RESUME     = False
+# warm start the Resi/Hybrid nets from the Label net of the case, which is
+# trained first if needed (opt-in: the reference sweep starts cold; warm
+# started nets belong in another resultsdir)
+WARMSTART  = False
+# test loss of the time-to-target record of the Resi/Hybrid nets (None: the
+# residual loss of the projections of the snapshots, Net.labeledLoss)
+TARGET_LOSS= None
+# progressive M: the nets of all but the smallest M of M_Vec start from the
+# finished net of the next smaller M (POD_Net.grow) and train PROGRESSIVE*EPOCH
+# epochs (0: off); the warm started Resi/Hybrid nets inherit it from the Label nets
+PROGRESSIVE= 0
+# results of the finished cases by the key of their case, data, options, code and
+# input files, see Cache; a case is trained again only if one of them changes,
+# e.g. CACHE = ResultCache(resultsdir + '/cache') (None: always train)
+CACHE      = None
+# the modules the results depend on, with CaseSim and Get*Data in the key
+CODE       = ('NN', 'Activations_plus', 'Normalization', 'Collocation', 'Samplers', \
+              'Chebyshev', 'ReducedOperators', 'Net1Dburges')
 
-# Control variables
-#ist1 = int(sys.argv[1])
-#ien1 = int(sys.argv[2])
-#ist2 = int(sys.argv[3])
-#ien2 = int(sys.argv[4])
-
-ist1 = 0
-ien1 = 8
-ist2 = 0
-ien2 = 3
+# Control variables: python3 Cases_test.py [ist1 ien1 ist2 ien2 [workers]], the
+# slices of M_Vec and Nettype_Vec of the sweep and its number of worker
+# processes (1: in this process), see Scheduler
+ist1, ien1, ist2, ien2 = [int(i) for i in sys.argv[1:5]] if len(sys.argv) > 4 else (0, 8, 0, 3)
+WORKERS = int(sys.argv[5]) if len(sys.argv) > 5 else 1
 
 
 M_Vec             = list(range(2,10,1))[ist1:ien1]
@@ -75,25 +109,61 @@ class gen_testcases(object):
                 localdict['M'] = M
                 for Nettype in Nettype_Vec:
                     localdict['Nettype']= Nettype
-                    yield localdict, Dict2Str(localdict)
+                    yield localdict.copy(), Dict2Str(localdict)
             
 
-    def Calculate(self):
+    def Calculate(self, workers=1):
+        if workers > 1:
+            results, failed = Sweep(self.CaseSim, self.Jobs(), workers, logdir=resultsdir)
+        else:
+            results, failed = {}, {}
+            for case in self:
+                print(case[1])
+                results[case[1]] = self.CaseSim(case)
         losshistory = {}
-        for case in self:
-            print(case[1])
-            losshistory[case[1]+'train'], losshistory[case[1]+'test']=self.CaseSim(case)
+        for name in [case[1] for case in self if case[1] in results]:
+            losshistory[name+'train'], losshistory[name+'test'], target = results[name]
+            # warm start, epoch and seconds to the target loss (-1, nan: not reached)
+            losshistory[name+'target'] = [target['warm'], target['epoch'], target['time']]
         from scipy.io import savemat
-        savemat('Test'+self.name+'_losshistory.mat', losshistory)
+        if Rank() == 0:     # data parallel under torchrun, see Parallel
+            savemat('Test'+self.name+'_losshistory.mat', losshistory)
+        if failed:
+            raise Exception('failed cases: ' + ', '.join(failed))
         return losshistory
+
+    def Jobs(self):
+        # the cases as jobs of Sweep, (name, case, names of the cases to train
+        # first); the Label nets the warm start needs are added if not in the sweep
+        jobs  = []
+        names = [case[1] for case in self]
+        for case in self:
+            if WARMSTART and case[0]['Nettype'] != 'Label':
+                labelcase = dict(case[0], Nettype='Label')
+                if Dict2Str(labelcase) not in names:
+                    names.append(Dict2Str(labelcase))
+                    jobs.append((Dict2Str(labelcase), (labelcase, Dict2Str(labelcase)), self.Depends(labelcase)))
+            jobs.append((case[1], case, self.Depends(case[0])))
+        return jobs
+
+    def Depends(self, case):
+        # the cases whose nets CaseSim starts from: the Label net of the warm
+        # start, or the net of the next smaller M of the progressive M
+        if WARMSTART and case['Nettype'] != 'Label':
+            return [Dict2Str(dict(case, Nettype='Label'))]
+        smaller = [M for M in M_Vec if M < case['M']]
+        if PROGRESSIVE and smaller:
+            return [Dict2Str(dict(case, M=max(smaller)))]
+        return []
     
     def CaseSim(self, case):
+        # with the cache, the random state of the case is the same whatever
+        # ran before it in this process (the jobs of a sweep worker, cached
+        # cases), so that its key is
+        if CACHE:
+            Seed(zlib.crc32(case[1].encode()))
         matfile = NumSolsdir  + '/'+'Burges1D_SampleNum='+str(case[0]['SampleNum'])+'.mat'
         netfile = resultsdir  + '/'+            case[1]             +'.net'
-        import os
-        if os.path.isfile(netfile):
-            pass
-            #continue
         roeqs = CustomedEqs(matfile, case[0]['M'])
         layers = [2, *[ case[0]['NetSize'] ]*3, case[0]['M']]
         Net =CustomedNet(layers=layers, roeqs=roeqs).to(DEVICE)
@@ -112,9 +182,53 @@ class gen_testcases(object):
             data = GetHybridData(roeqs,case[0]['NResi'])
             options['weight_decay']=0
             options['NBATCH'] = 10
+        if RESAMPLE and case[0]['Nettype'] != 'Label':
+            options['resample'] = Resampler(lambda N: GetResiData(roeqs,N)[0:2], **RESAMPLE)
+        if VALIDATE:
+            options['metric'] = GetMetric(roeqs, VALIDATE)
+        options['resume'] = RESUME
+        # the nets this one starts from, inputs of its cache key
+        starts = []
+        warm = WARMSTART and case[0]['Nettype'] != 'Label'
+        if warm:
+            labelcase = case[0].copy()
+            labelcase['Nettype'] = 'Label'
+            labelfile = resultsdir  + '/'+ Dict2Str(labelcase)+'.net'
+            if CACHE or not Finished(labelfile):
+                state = RNGState()
+                self.CaseSim((labelcase, Dict2Str(labelcase)))
+                SetRNGState(state)
+            Net.warmstart(labelfile)
+            starts.append(labelfile)
+        smaller = [M for M in M_Vec if M < case[0]['M']]
+        if PROGRESSIVE and not warm and smaller:
+            prevcase = case[0].copy()
+            prevcase['M'] = max(smaller)
+            prevfile = resultsdir  + '/'+ Dict2Str(prevcase)+'.net'
+            if Finished(prevfile):
+                Net.grow(prevfile)
+                starts.append(prevfile)
+                options['EPOCH'] = max(int(EPOCH*PROGRESSIVE), 1)
+        if case[0]['Nettype'] != 'Label':
+            options['target_loss'] = TARGET_LOSS if TARGET_LOSS is not None else float(Net.labeledLoss)
+        if CACHE:
+            key = CaseKey(case[0], options, Code(), [matfile] + starts, data)
+            result = CACHE.load(key, netfile if Rank() == 0 else None)
+            if result is not None:
+                print('cached ' + case[1] + ' ' + key[:12])
+                return result
+            if Rank() == 0:
+                CACHE.claim(key, netfile)
         # train the net and save loss history
         trainhistory, testhistory=train(Net,data, netfile, options=options)
-        return trainhistory, testhistory
+        result = (trainhistory, testhistory, dict(Net.target, warm=warm))
+        if CACHE and Rank() == 0:
+            CACHE.store(key, result, netfile, case=case[0])
+        return result
+
+# the code of the cache key
+def Code():
+    return SourceDigest(CODE, (gen_testcases.CaseSim, GetLabelData, GetResiData, GetHybridData, GetMetric))
 
 # Prepare trainning data
 # projection  data
@@ -123,9 +237,8 @@ def GetLabelData(roeqs):
     labeled_outputs= roeqs.projections.T 
     return (labeled_inputs, labeled_outputs, 'Label',0.9,)
 # Residual points
-def GetResiData(roeqs,Np):
-    Nin = roeqs.design_space.shape[1]
-    Resi_inputs  = Normalization.Anti_Mapminmax(np.random.rand(Np, Nin)*2-1,  roeqs.design_space)
+def GetResiData(roeqs,Np,method=None):
+    Resi_inputs  = Samples(roeqs.design_space, Np, method or SAMPLER)
     alpha1 = Resi_inputs[:,0:1]; alpha2=Resi_inputs[:,1:2]
     Resi_source = roeqs.getsource(alpha1, alpha2)
     return (Resi_inputs, Resi_source, 'Resi',0.9,)
@@ -134,9 +247,14 @@ def GetHybridData(roeqs,Np):
     LabelData = GetLabelData(roeqs)
     ResiData  = GetResiData(roeqs,Np) 
     return (LabelData[0], LabelData[1],ResiData[0],ResiData[1],'Hybrid',ResiData[3],)
+# Validation metric of the early stopping
+def GetMetric(roeqs,Nval):
+    alpha = Samples(roeqs.design_space, Nval, 'sobol')
+    x = torch.tensor(alpha).float().to(DEVICE)
+    return lambda Net: roeqs.GetError(alpha, Net(x))
 
 if __name__ == '__main__':
-    gen_testcases('SampleNum').Calculate()
+    gen_testcases('SampleNum').Calculate(WORKERS)
 #    gen_testcases('NetSize'  ).Calculate()
 #    gen_testcases('NResi'    ).Calculate()
     # test
@@ -40,6 +40,9 @@ import torch
 import torch.autograd as ag
 from NN import POD_Net, DEVICE
 from Normalization import Normalization
+from ReducedOperators import LowRankTensor, SymPackedTensor
+from SolverStats import SolverStats
+import time
 
 # Eqs parameters
 a  = 1
@@ -51,7 +54,7 @@ np.random.seed(1234)
 
 
 class CustomedEqs():    
-    def __init__(self, matfile, M):
+    def __init__(self, matfile, M, Atol=None, Amethod='tucker'):
         datas = loadmat(matfile)
         self.Samples = datas['Samples']
         self.xgrid   = datas['xgrid']
@@ -78,6 +81,14 @@ class CustomedEqs():
         self.proj_mean =  Mapping[0][None,:] 
         self.proj_std  =  Mapping[1][None,:] 
         
+        # quadratic operator: symmetric packed A, or its low-rank
+        # compression (CP/Tucker) with relative tolerance Atol
+        if Atol:
+            self.Aop = LowRankTensor(self.getA(), tol=Atol, method=Amethod)
+            print('Compressed A:', self.Aop)
+        else:
+            self.Aop = SymPackedTensor.Pack(self.getA())
+        
     # get A from the first mth modes
     def getA(self): 
         V_x = np.matmul(self.dx, self.Modes);  
@@ -98,39 +109,47 @@ class CustomedEqs():
         B = np.matmul(tmp,self.Modes)
         return B
     
-    def POD_G(self,Mchoose, alpha):
+    def POD_G(self,Mchoose, alpha, stats=False):
+        """stats=True also returns the SolverStats of the cases"""
         alpha1 = alpha[:,0:1]
         alpha2 = alpha[:,1:2]
         n = alpha1.shape[0]
         lamda  = np.zeros((alpha.shape[0], self.M))
-        def compute_eAe(A, e):
-            tmp  = np.matmul(e.T, A)
-            return np.matmul(tmp, e).squeeze(axis=(2))
-        def compute_dA(A,e):
-            return np.matmul(A+A.transpose((0, 2,1)), e).squeeze(axis=(2))
-        
-        A = self.getA()
-        B = self.getB()
+        Stats  = SolverStats(n, 'POD-G Newton')
+        def compute_eAe(e):
+            return self.Aop.quad(e.T).T
+        def compute_dA(e):
+            return self.Aop.jac(e.T)[0]
+        
+        with Stats.timer('assemble'):
+            B = self.getB()
         for i in range(n):
+            tic = time.perf_counter()
             alpha1i = alpha1[i:i+1,0:1]; alpha2i = alpha2[i:i+1, 0:1];
-            source = self.getsource(alpha1i, alpha2i).T
+            with Stats.timer('source'):
+                source = self.getsource(alpha1i, alpha2i).T
             dis = alpha[i:i+1,:] - self.parameters
             dis = np.linalg.norm(dis, axis=1);
             ind = np.where(dis == dis.min())[0][0]
             lamda0 = self.projections[0:self.M, ind:ind+1]
+            lamdainit = lamda0
             #Newton iteration
             it = 0; err =1;
-            while it<=Newton['iterMax'] and err>Newton['eps']:
-                it +=1
-                R0 = compute_eAe(A,lamda0) + np.matmul(B,lamda0) - source
-                err = np.linalg.norm(R0)
-                dR = compute_dA(A,lamda0) + B
-                dlamda = -np.linalg.solve(dR, R0)
-                lamda0 =lamda0 + dlamda
+            with Stats.timer('solve'):
+                while it<=Newton['iterMax'] and err>Newton['eps']:
+                    it +=1
+                    R0 = compute_eAe(lamda0) + np.matmul(B,lamda0) - source
+                    err = np.linalg.norm(R0)
+                    dR = compute_dA(lamda0) + B
+                    dlamda = -np.linalg.solve(dR, R0)
+                    lamda0 =lamda0 + dlamda
+            Stats.record(i, it, err, time.perf_counter()-tic, lamdainit, lamda0, err<=Newton['eps'])
             if it>=Newton['iterMax']:
                 print('Case (%f,%f) can only reach to an error of %f'%(alpha1[i,0], alpha2[i,0], err))
                 lamda0 = lamda0*0 + np.inf
             lamda[i,:] = lamda0.squeeze()
+        if stats:
+            return lamda, Stats
         return lamda
     
     def GetError(self,alpha,lamda):
@@ -175,7 +194,7 @@ class CustomedNet(POD_Net):
     def __init__(self, layers=None,oldnetfile=None,roeqs=None):
         super(CustomedNet, self).__init__(layers=layers,OldNetfile=oldnetfile)
         self.M = roeqs.M
-        self.A = torch.tensor( roeqs.getA() ).float().to(DEVICE)
+        self.Aop = roeqs.Aop.to(DEVICE)
         self.B = torch.tensor( roeqs.getB() ).float().to(DEVICE)
         self.lb = torch.tensor(roeqs.design_space[0:1,:]).float().to(DEVICE)
         self.ub = torch.tensor(roeqs.design_space[1:2,:]).float().to(DEVICE)
@@ -191,7 +210,7 @@ class CustomedNet(POD_Net):
         
     def u_net(self,x):
         x = (x-(self.ub+self.lb)/2)/(self.ub-self.lb)*2
-        out = self.unet(x)
+        out = self.mlp(x)
         out = out*self.proj_std + self.proj_mean
         return out
     
@@ -210,10 +229,7 @@ class CustomedNet(POD_Net):
     def loss_Eqs(self,x,lamda,source,weight=1):
 #    def loss_PINN(self,x,source):
         #lamda = self.u_net(x);
-        fx   = torch.matmul(lamda[:,None,None,:], self.A[None,:,:,:])
-        fx   = torch.matmul(fx,lamda[:,None,:,None])
-        fx   = fx.view(lamda.shape)
-        fx   = fx + torch.matmul( lamda, self.B.T) -source
+        fx   = self.Aop.quad(lamda) + torch.matmul( lamda, self.B.T) -source
         return self.lossfun(weight*fx,torch.zeros_like(fx))
         
 if __name__ == '__main__':
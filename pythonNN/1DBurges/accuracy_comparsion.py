@@ -44,7 +44,8 @@ def CalculateError(testcases):
         if os.path.isfile(PODGfile):
             lamda_G = loadmat(PODGfile)['lamda_G']
         else:
-            lamda_G = roeqs.POD_G(M, alpha)
+            lamda_G, stats = roeqs.POD_G(M, alpha, stats=True)
+            print(stats.summary())
             savemat(PODGfile, {'lamda_G':lamda_G})
         Error[ind,indM,0] = roeqs.GetError(alpha,lamda_G)
         
@@ -47,8 +47,11 @@ from Chebyshev import Chebyshev2D
 from scipy.io import loadmat
 import numpy as np
 import torch
+import time
 from NN import POD_Net, DEVICE
 from Normalization import Normalization
+from ReducedOperators import LowRankTensor, SymPackedTensor, AffineOperator
+from SolverStats import SolverStats
 from scipy.optimize import fsolve
 
 # Eqs parameters
@@ -62,7 +65,7 @@ np.random.seed(1234)
 
 
 class CustomedEqs():    
-    def __init__(self, matfilePOD,PODNum,matfileValidation, M):
+    def __init__(self, matfilePOD,PODNum,matfileValidation, M, Atol=None, Amethod='tucker'):
         datas = loadmat(matfilePOD)
         # data for POD
         #PODNum=3
@@ -103,7 +106,17 @@ class CustomedEqs():
         self.uBC = np.reshape(self.Samples[1::NVARLOAD,0], self.FieldShape)*self.Boundary
         self.InteriorShape = (self.FieldShape[0]-2, self.FieldShape[1]-2,)
         self.Beqs, self.Bbc = self.getB()
-        self.Aeqs, self.Abc = self.getA()
+        Aeqs, self.Abc = self.getA()
+        # quadratic operator: symmetric packed Aeqs, or its low-rank
+        # compression (CP/Tucker) with relative tolerance Atol
+        if Atol:
+            self.Aop = LowRankTensor(Aeqs, tol=Atol, method=Amethod)
+            print('Compressed Aeqs:', self.Aop)
+        else:
+            self.Aop = SymPackedTensor.Pack(Aeqs)
+        # affine operator weighted by the coefficients of getAffineCoef
+        self.Aff = AffineOperator(self.Aop, np.concatenate((self.Abc, self.Beqs)), \
+                                  np.concatenate((0*self.Abc[:,:,0], self.Bbc)) )
         
         # Compute projection error
         self.lamda_proj = np.matmul(self.ValidationSamples.T, self.Modes)
@@ -229,26 +242,38 @@ class CustomedEqs():
         Acoef = cat((Jac11, Jac12, Jac21, Jac22),axis=1)
         BCoef = cat((Jac11, Jac12, Jac21, Jac22, v*(Jac11**2+Jac21**2), v*(Jac12**2+Jac22**2), 2*v*(Jac11*Jac12+Jac21*Jac22)), axis=1)
         return Acoef, BCoef
+
+    def getAffineCoef(self, alpha, **kwargs):
+        # coefficients of the quadratic terms (Aeqs) and of the linear/constant terms (Abc+Beqs, Bbc)
+        cat = kwargs.get('cat', np.concatenate)
+        Acoef, BCoef = self.getABCoef(alpha, **kwargs)
+        return Acoef, cat((Acoef, BCoef), axis=1)
     
-    def POD_Gfsolve(self,alpha, lamda_init=None):
+    def POD_Gfsolve(self,alpha, lamda_init=None, stats=False):
+        """stats=True also returns the SolverStats of the cases"""
         n = alpha.shape[0]
         lamda  = np.zeros((n, self.M))
+        Stats  = SolverStats(n, 'POD-G fsolve')
         def compute_eAe(A, e):
-            tmp  = np.matmul(e.T, A)
-            return np.matmul(tmp, e).squeeze(axis=(2))
+            return A.quad(e.T).T
+        def compute_dA(A, e):
+            return A.jac(e.T)[0]
         def eqs(x,A,B,source):
             lamda = x[:,None];
             lamda = lamda*self.proj_std.T + self.proj_mean.T
             err = compute_eAe(A,lamda) + np.matmul(B,lamda) -source
             return err.squeeze()
+        def deqs(x,A,B,source):
+            lamda = x[:,None];
+            lamda = lamda*self.proj_std.T + self.proj_mean.T
+            return (compute_dA(A,lamda) + B)*self.proj_std
+        # operators of all the cases, assembled at once
+        with Stats.timer('assemble'):
+            A, B, source = self.Aff.Assemble( *self.getAffineCoef(alpha[:,0:2]) )
         for i in range(n):
             alphai = alpha[i:i+1,0:2]
-            AiCoeff, BiCoeff = self.getABCoef(alphai)
-            AiCoeff, BiCoeff = AiCoeff.squeeze(axis=0), BiCoeff.squeeze(axis=0)
-            Ai = ( AiCoeff[:,None,None,None]* self.Aeqs ).sum(axis=0)
-            Bi = ( AiCoeff[:,None,None]* self.Abc  ).sum(axis=0) \
-                +( BiCoeff[:,None,None]* self.Beqs ).sum(axis=0)
-            sourcei = -( BiCoeff[:,None]* self.Bbc  ).sum(axis=0)[:,None]
+            tic = time.perf_counter()
+            Ai, Bi, sourcei = A.Case(i), B[i], -source[i][:,None]
             
             if lamda_init is None:
                 dis = (alphai - self.parameters)/ (self.design_space[1:2,:]-self.design_space[0:1,:] )
@@ -257,23 +282,32 @@ class CustomedEqs():
                 lamda0 = self.projections[0:self.M, ind:ind+1].T
             else:
                 lamda0 = lamda_init[i:i+1,:]   
+            lamdainit = lamda0
             lamda0 = (lamda0-self.proj_mean)/self.proj_std
-            lamdasol = fsolve(lambda x: eqs(x,Ai,Bi,sourcei), lamda0.squeeze())
+            with Stats.timer('solve'):
+                lamdasol, info, ier, _ = fsolve(lambda x: eqs(x,Ai,Bi,sourcei), lamda0.squeeze(), \
+                                                fprime=lambda x: deqs(x,Ai,Bi,sourcei), full_output=True)
             err = np.linalg.norm( eqs(lamdasol, Ai, Bi, sourcei) )
             if err > Newton["eps"]:
                 print('Case %d: (%f,%f) can only reach to an error of %f'%(i, alphai[0,0], alphai[0,1], err))
                 #lamdasol = lamdasol*0 + np.inf
             lamda[i,:] = lamdasol[None,:]*self.proj_std + self.proj_mean
+            Stats.record(i, -1, err, time.perf_counter()-tic, lamdainit, lamda[i:i+1,:], \
+                         ier == 1 and err <= Newton["eps"], nfev=info['nfev'])
             
+        if stats:
+            return lamda, Stats
         return lamda
     
     
-    def GetError(self,lamda):
-        Nvalidation =self.ValidationParameters.shape[0]
+    def GetError(self,lamda,ind=None,verbose=True):
+        # ind: errors on a subset of the validation cases only
+        ind = np.arange(self.ValidationParameters.shape[0]) if ind is None else ind
+        Nvalidation = ind.shape[0]
         if  Nvalidation != lamda.shape[0]:
             raise Exception('The number of lamda should be equal to validation parameters')
         phi_pred         = np.matmul( lamda, self.Modes.T)
-        phi_Num          = self.ValidationSamples.T
+        phi_Num          = self.ValidationSamples[:,ind].T
         Error = np.zeros((Nvalidation,NVAR))    # the second dimension is [p,u,v]
         for nvar in range(NVAR):
             Error[:,nvar] = np.linalg.norm(phi_Num[:,nvar::NVAR]-phi_pred[:,nvar::NVAR], axis = 1)\
@@ -281,9 +315,11 @@ class CustomedEqs():
         Errorpuv = Error.mean(axis=0)
         Errortotal =  np.linalg.norm(phi_Num[:,:]-phi_pred[:,:], axis = 1)\
                                    /np.linalg.norm(phi_Num[:,:], axis=1)
-        print(Errortotal)
+        if verbose:
+            print(Errortotal)
         Errortotal = Errortotal.mean(axis=0)
-        print("Errors=[%f,%f,%f],%f"%(Errorpuv[0],Errorpuv[1],Errorpuv[2], Errortotal))
+        if verbose:
+            print("Errors=[%f,%f,%f],%f"%(Errorpuv[0],Errorpuv[1],Errorpuv[2], Errortotal))
         return Errorpuv, Errortotal
         
     def GetPredFields(self,alpha,lamda, filename):
@@ -342,13 +378,11 @@ zone,j=%d, i=%d,f=point"""%(Ny,Nx) + "\n"
 
     
 class CustomedNet(POD_Net):
-    def __init__(self, layers=None,oldnetfile=None,roeqs=None):
+    def __init__(self, layers=None,oldnetfile=None,roeqs=None,chunk=None):
         super(CustomedNet, self).__init__(layers=layers,OldNetfile=oldnetfile)
         self.M = roeqs.M
-        self.Aeqs = torch.tensor( roeqs.Aeqs ).float().to(DEVICE)
-        self.Abc  = torch.tensor( roeqs.Abc  ).float().to(DEVICE)
-        self.Beqs = torch.tensor( roeqs.Beqs ).float().to(DEVICE)
-        self.Bbc  = torch.tensor( roeqs.Bbc  ).float().to(DEVICE)
+        self.chunk = chunk    # max cases per residual evaluation, see AffineOperator
+        self.Aff  = roeqs.Aff.to(DEVICE)
         self.lb   = torch.tensor(roeqs.design_space[0:1,:]).float().to(DEVICE)
         self.ub   = torch.tensor(roeqs.design_space[1:2,:]).float().to(DEVICE)
         self.proj_std = torch.tensor( roeqs.proj_std ).float().to(DEVICE)
@@ -361,7 +395,7 @@ class CustomedNet(POD_Net):
         pass
     def u_net(self,x):
         x = (x-(self.ub+self.lb)/2)/(self.ub-self.lb)*2
-        out = self.unet(x)
+        out = self.mlp(x)
         out = out*self.proj_std + self.proj_mean
         return out
     
@@ -379,14 +413,8 @@ class CustomedNet(POD_Net):
         
     def loss_Eqs(self,x,lamda,weight=1):
         #lamda = self.u_net(x);
-        ACoeff, BCoeff = self.roeqs.getABCoef(x, cos=torch.cos, sin=torch.sin, cat=torch.cat)
-        A = ( ACoeff[:,:,None,None,None]* self.Aeqs[None,:,:,:,:] ).sum(axis=1)
-        B = ( ACoeff[:,:,None,None]* self.Abc[ None,:,:,:]  ).sum(axis=1) \
-           +( BCoeff[:,:,None,None]* self.Beqs[None,:,:,:]  ).sum(axis=1)
-        source = -( BCoeff[:,:,None]* self.Bbc[None,:,:]  ).sum(axis=1)
-        fx   = torch.matmul(lamda[:,None,None,:], A)
-        fx   = torch.matmul(fx,lamda[:,None,:,None])
-        fx   = fx.view(lamda.shape) + torch.matmul(B,lamda[:,:,None]).view(lamda.shape) -source
+        ACoeff, BCoeff = self.roeqs.getAffineCoef(x, cos=torch.cos, sin=torch.sin, cat=torch.cat)
+        fx   = self.Aff.residual(lamda, ACoeff, BCoeff, self.chunk)
         return self.lossfun(weight*fx,torch.zeros_like(fx))
     
 
@@ -42,7 +42,8 @@ def CalculateError(testcases):
         if os.path.isfile(PODGfile) and 0>1:
             lamda_G = loadmat(PODGfile)['lamda_G']
         else:
-            lamda_G = roeqs.POD_Gfsolve(alpha, roeqs.lamda_proj)
+            lamda_G, stats = roeqs.POD_Gfsolve(alpha, roeqs.lamda_proj, stats=True)
+            print(stats.summary())
             savemat(PODGfile, {'lamda_G':lamda_G})
         # PODG error
         Error[ind,indM,0] = roeqs.GetError(lamda_G)[1]
@@ -35,8 +35,11 @@ from Chebyshev import Chebyshev2D
 from scipy.io import loadmat
 import numpy as np
 import torch
+import time
 from NN import POD_Net, DEVICE
 from Normalization import Normalization
+from ReducedOperators import LowRankTensor, SymPackedTensor, AffineOperator
+from SolverStats import SolverStats
 from scipy.optimize import fsolve, root
 
 # Eqs parameters
@@ -50,7 +53,7 @@ np.random.seed(1234)
 
 
 class CustomedEqs():    
-    def __init__(self, matfilePOD,PODNum,matfileValidation, M):
+    def __init__(self, matfilePOD,PODNum,matfileValidation, M, Atol=None, Amethod='tucker'):
         datas = loadmat(matfilePOD)
         # data for POD
         self.Samples      = datas['Samples'][:,0:PODNum]
@@ -99,7 +102,17 @@ class CustomedEqs():
         TM = self.dy[0::self.InteriorShape[0]+1,0::self.InteriorShape[1]+1]
         self.invTM = np.linalg.inv(TM)
         self.Beqs, self.Bbc = self.getB()
-        self.Aeqs, self.Abc = self.getA()
+        Aeqs, self.Abc = self.getA()
+        # quadratic operator: symmetric packed Aeqs, or its low-rank
+        # compression (CP/Tucker) with relative tolerance Atol
+        if Atol:
+            self.Aop = LowRankTensor(Aeqs, tol=Atol, method=Amethod)
+            print('Compressed Aeqs:', self.Aop)
+        else:
+            self.Aop = SymPackedTensor.Pack(Aeqs)
+        # affine operator weighted by the coefficients of getAffineCoef
+        self.Aff = AffineOperator(self.Aop, np.concatenate((self.Abc, self.Beqs)), \
+                                  np.concatenate((0*self.Abc[:,:,0], self.Bbc)) )
 
         # Compute projection error
         self.lamda_proj = np.matmul(self.ValidationSamples.T, self.Modes)
@@ -214,26 +227,38 @@ class CustomedEqs():
         Acoef = one
         BCoef = cat((sqrt(Pr/Ra), 1/sqrt(Pr*Ra), sin(Theta), cos(Theta), one), axis=1)
         return Acoef, BCoef
+
+    def getAffineCoef(self, alpha, **kwargs):
+        # coefficients of the quadratic terms (Aeqs) and of the linear/constant terms (Abc+Beqs, Bbc)
+        cat = kwargs.get('cat', np.concatenate)
+        Acoef, BCoef = self.getABCoef(alpha, **kwargs)
+        return Acoef, cat((Acoef, BCoef), axis=1)
         
-    def POD_Gfsolve(self,alpha, lamda_init= None):
+    def POD_Gfsolve(self,alpha, lamda_init= None, stats=False):
+        """stats=True also returns the SolverStats of the cases"""
         n = alpha.shape[0]
         lamda  = np.zeros((n, self.M))
+        Stats  = SolverStats(n, 'POD-G fsolve')
         def compute_eAe(A, e):
-            tmp  = np.matmul(e.T, A)
-            return np.matmul(tmp, e).squeeze(axis=(2))
+            return A.quad(e.T).T
+        def compute_dA(A, e):
+            return A.jac(e.T)[0]
         def eqs(x,A,B,source):
             lamda = x[:,None];
             lamda = lamda*self.proj_std.T + self.proj_mean.T
             err = compute_eAe(A,lamda) + np.matmul(B,lamda) -source
             return err.squeeze()
+        def deqs(x,A,B,source):
+            lamda = x[:,None];
+            lamda = lamda*self.proj_std.T + self.proj_mean.T
+            return (compute_dA(A,lamda) + B)*self.proj_std
+        # operators of all the cases, assembled at once
+        with Stats.timer('assemble'):
+            A, B, source = self.Aff.Assemble( *self.getAffineCoef(alpha[:,0:3]) )
         for i in range(n):
             alphai = alpha[i:i+1,0:3]
-            AiCoeff, BiCoeff = self.getABCoef(alphai)
-            AiCoeff, BiCoeff = AiCoeff.squeeze(axis=0), BiCoeff.squeeze(axis=0)
-            Ai = ( AiCoeff[:,None,None,None]* self.Aeqs ).sum(axis=0)
-            Bi = ( AiCoeff[:,None,None]* self.Abc  ).sum(axis=0) \
-                +( BiCoeff[:,None,None]* self.Beqs ).sum(axis=0)
-            sourcei = -( BiCoeff[:,None]* self.Bbc  ).sum(axis=0)[:,None]
+            tic = time.perf_counter()
+            Ai, Bi, sourcei = A.Case(i), B[i], -source[i][:,None]
             
             if lamda_init is None:
                 dis = (alphai - self.parameters)/ (self.design_space[1:2,:]-self.design_space[0:1,:] )
@@ -242,23 +267,32 @@ class CustomedEqs():
                 lamda0 = self.projections[0:self.M, ind:ind+1].T
             else:
                 lamda0 = lamda_init[i:i+1,:]   
+            lamdainit = lamda0
             lamda0 = (lamda0-self.proj_mean)/self.proj_std
-            lamdasol = fsolve(lambda x: eqs(x,Ai,Bi,sourcei), lamda0.squeeze())
+            with Stats.timer('solve'):
+                lamdasol, info, ier, _ = fsolve(lambda x: eqs(x,Ai,Bi,sourcei), lamda0.squeeze(), \
+                                                fprime=lambda x: deqs(x,Ai,Bi,sourcei), full_output=True)
             err = np.linalg.norm( eqs(lamdasol, Ai, Bi, sourcei) )
             if err > Newton["eps"]:
                 print('Case (%d) can only reach to an error of %f'%(i, err))
                 #print('Case (%f,%f,%f) can only reach to an error of %f'%(alphai[0,0], alphai[0,1], alphai[0,2], err))
                 #lamdasol = lamdasol*0 + np.inf
             lamda[i,:] = lamdasol[None,:]*self.proj_std + self.proj_mean
+            Stats.record(i, -1, err, time.perf_counter()-tic, lamdainit, lamda[i:i+1,:], \
+                         ier == 1 and err <= Newton["eps"], nfev=info['nfev'])
+        if stats:
+            return lamda, Stats
         return lamda
     
     
-    def GetError(self,lamda):
-        Nvalidation =self.ValidationParameters.shape[0]
+    def GetError(self,lamda,ind=None,verbose=True):
+        # ind: errors on a subset of the validation cases only
+        ind = np.arange(self.ValidationParameters.shape[0]) if ind is None else ind
+        Nvalidation = ind.shape[0]
         if  Nvalidation != lamda.shape[0]:
             raise Exception('The number of lamda should be equal to validation parameters')
         phi_pred         = np.matmul( lamda, self.Modes.T)
-        phi_Num          = self.ValidationSamples.T
+        phi_Num          = self.ValidationSamples[:,ind].T
         Error = np.zeros((Nvalidation,NVAR))    # the second dimension is [p,u,v]
         for nvar in range(NVAR):
             Error[:,nvar] = np.linalg.norm(phi_Num[:,nvar::NVAR]-phi_pred[:,nvar::NVAR], axis = 1)\
@@ -269,7 +303,8 @@ class CustomedEqs():
 #        for i in range(Nvalidation):
 #            print(i,'%e'%Errortotal[i])
         Errortotal = Errortotal.mean(axis=0)
-        print("Errors=[%f,%f,%f,%f],%f"%(ErrorpuvT[0],ErrorpuvT[1],ErrorpuvT[2],ErrorpuvT[3], Errortotal))
+        if verbose:
+            print("Errors=[%f,%f,%f,%f],%f"%(ErrorpuvT[0],ErrorpuvT[1],ErrorpuvT[2],ErrorpuvT[3], Errortotal))
         return ErrorpuvT, Errortotal
         
     def getGrid(self,alpha,cos=np.cos, sin=np.sin):
@@ -333,13 +368,11 @@ zone,j=%d, i=%d,f=point"""%(Ny,Nx) + "\n"
 
     
 class CustomedNet(POD_Net):
-    def __init__(self, layers=None,oldnetfile=None,roeqs=None):
+    def __init__(self, layers=None,oldnetfile=None,roeqs=None,chunk=None):
         super(CustomedNet, self).__init__(layers=layers,OldNetfile=oldnetfile)
         self.M = roeqs.M
-        self.Aeqs = torch.tensor( roeqs.Aeqs ).float().to(DEVICE)
-        self.Abc  = torch.tensor( roeqs.Abc  ).float().to(DEVICE)
-        self.Beqs = torch.tensor( roeqs.Beqs ).float().to(DEVICE)
-        self.Bbc  = torch.tensor( roeqs.Bbc  ).float().to(DEVICE)
+        self.chunk = chunk    # max cases per residual evaluation, see AffineOperator
+        self.Aff  = roeqs.Aff.to(DEVICE)
         self.lb   = torch.tensor(roeqs.design_space[0:1,:]).float().to(DEVICE)
         self.ub   = torch.tensor(roeqs.design_space[1:2,:]).float().to(DEVICE)
         self.proj_std = torch.tensor( roeqs.proj_std ).float().to(DEVICE)
@@ -354,7 +387,7 @@ class CustomedNet(POD_Net):
         
     def u_net(self,x):
         x = (x-(self.ub+self.lb)/2)/(self.ub-self.lb)*2
-        out = self.unet(x)
+        out = self.mlp(x)
         out = out*self.proj_std + self.proj_mean
         return out
     
@@ -372,14 +405,8 @@ class CustomedNet(POD_Net):
     
     def loss_Eqs(self,x,lamda,weight=1):
         #lamda = self.u_net(x);
-        ACoeff, BCoeff = self.roeqs.getABCoef(x, cos=torch.cos, sqrt=torch.sqrt, sin=torch.sin, cat=torch.cat)
-        A = self.Aeqs
-        B = self.Abc \
-           +( BCoeff[:,:,None,None]* self.Beqs[None,:,:,:]  ).sum(axis=1)
-        source = -( BCoeff[:,:,None]* self.Bbc[None,:,:]  ).sum(axis=1)
-        fx   = torch.matmul(lamda[:,None,None,:], A)
-        fx   = torch.matmul(fx,lamda[:,None,:,None])
-        fx   = fx.view(lamda.shape) + torch.matmul(B,lamda[:,:,None]).view(lamda.shape) -source
+        ACoeff, BCoeff = self.roeqs.getAffineCoef(x, cos=torch.cos, sqrt=torch.sqrt, sin=torch.sin, cat=torch.cat)
+        fx   = self.Aff.residual(lamda, ACoeff, BCoeff, self.chunk)
         return self.lossfun(weight*fx,torch.zeros_like(fx))
         
 if __name__ == '__main__':
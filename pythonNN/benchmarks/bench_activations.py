@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Benchmark
+Forward and backward time and activation memory of the activations of
+Activations_plus on a (N, width) batch, as in the hidden layers of a net
+evaluated on N residual points. The memory is the size of the tensors saved
+for the backward pass by the activation; product is the former Swish,
+x*sigmoid(x) with plain autograd, for reference.
+
+    python bench_activations.py [width] [N,N,...] [NREP]
+"""
+import sys
+import os
+import time
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'NNs'))
+from Activations_plus import Activation, ACTIVATIONS
+
+width  = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+SIZES  = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [10**4, 10**5, 10**6]
+NREP   = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+NAMES  = ['product', *ACTIVATIONS, 'adaptive_tanh']
+
+class Product(torch.nn.Module):
+    def forward(self, x):
+        return x * torch.sigmoid(x)
+
+def SavedBytes(fun, x):
+    # bytes of the distinct tensors autograd saves for the backward pass
+    saved = {}
+    def pack(t):
+        saved[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        fun(x)
+    # the input of the activation is the output of the previous layer and is
+    # kept by it anyway
+    saved.pop(x.untyped_storage().data_ptr(), None)
+    return sum(saved.values())
+
+def measure(act, x):
+    grad = torch.ones_like(x)
+    forward = backward = 0
+    for i in range(NREP + 1):
+        xi = x.detach().requires_grad_()
+        tic = time.perf_counter()
+        y = act(xi)
+        toc = time.perf_counter()
+        y.backward(grad)
+        if i > 0:       # the first repetition warms up
+            forward  += toc - tic
+            backward += time.perf_counter() - toc
+    return forward/NREP, backward/NREP
+
+if __name__ == '__main__':
+    torch.manual_seed(1234)
+    print('width %d, %d threads, mean of %d repetitions'%(width, torch.get_num_threads(), NREP))
+    print('%-14s %10s %12s %12s %12s'%('activation', 'N', 'forward ms', 'backward ms', 'saved MB'))
+    for N in SIZES:
+        x = torch.randn(N, width).requires_grad_()
+        for name in NAMES:
+            act = Product() if name == 'product' else Activation(name)
+            forward, backward = measure(act, x)
+            print('%-14s %10d %12.3f %12.3f %12.2f'%(name, N, forward*1E3, backward*1E3, SavedBytes(act, x)/2**20))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Benchmark
+Training steps per second of the 1D Burges nets with the former
+TensorDataset/random_split/DataLoader pipeline and with the device resident
+Batcher of train(), for the Label, Resi and Hybrid data.
+
+    python bench_batching.py [EPOCH] [NResi]
+"""
+import sys
+import time
+from problems import Load
+Cases, roeqs = Load('1DBurges', 6)
+
+import torch
+import torch.utils.data as Data
+from NN import Batcher, random_split, DEVICE
+from Cases_test import GetLabelData, GetResiData, GetHybridData
+
+EPOCH = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+NResi = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+M     = roeqs.M
+
+def loaders(data, NBATCH, dataloader):
+    inputs, outputs = data[-4], data[-3]
+    tensors = (torch.tensor(inputs).float().to(DEVICE),\
+               torch.tensor(outputs).float().to(DEVICE),\
+               torch.ones((inputs.shape[0], 1)).float().to(DEVICE),)
+    trainsize = int(inputs.shape[0]*data[-1])
+    if dataloader:
+        trainset, _ = Data.random_split(Data.TensorDataset(*tensors), [trainsize, inputs.shape[0]-trainsize])
+        return Data.DataLoader(trainset, batch_size=trainsize//NBATCH, shuffle=True)
+    trainset, _ = random_split(tensors, trainsize)
+    return Batcher(trainset, batch_size=trainsize//NBATCH, shuffle=True)
+
+def steps_per_second(roeqs, datatype, data, NBATCH, dataloader):
+    torch.manual_seed(1234)
+    Net = Cases.CustomedNet(layers=[2,20,20,20,M], roeqs=roeqs).to(DEVICE)
+    optimizer = torch.optim.Adam(Net.parameters(), lr=0.01)
+    if datatype == 'Label':
+        Netloss = lambda x,y,w: Net.loss_NN(x,y)
+    elif datatype == 'Resi':
+        Netloss = Net.loss_PINN
+    else:
+        xlabel = torch.tensor(data[0]).float().to(DEVICE)
+        ylabel = torch.tensor(data[1]).float().to(DEVICE)
+        Netloss = lambda x,y,w: Net.loss_NN(xlabel,ylabel) + Net.loss_PINN(x,y,w)
+    loader = loaders(data, NBATCH, dataloader)
+    nstep = 0
+    tic = time.perf_counter()
+    for epoch in range(EPOCH):
+        for x, y, w in loader:
+            optimizer.zero_grad()
+            loss = Netloss(x, y, w)
+            loss.backward()
+            optimizer.step()
+            nstep += 1
+    return nstep/(time.perf_counter()-tic)
+
+if __name__ == '__main__':
+    cases = (('Label',  GetLabelData(roeqs),         1),
+             ('Resi',   GetResiData(roeqs, NResi),  10),
+             ('Hybrid', GetHybridData(roeqs, NResi),10),)
+    print('%-8s %14s %14s %8s'%('Nettype', 'DataLoader', 'Batcher', 'speedup'))
+    for datatype, data, NBATCH in cases:
+        old = steps_per_second(roeqs, datatype, data, NBATCH, True)
+        new = steps_per_second(roeqs, datatype, data, NBATCH, False)
+        print('%-8s %10.1f it/s %10.1f it/s %7.2fx'%(datatype, old, new, new/old))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Benchmark
+Training steps per second of CustomedNet in eager mode and with the compiled
+forward+loss path (POD_Net.Compile), for the residual loss of one problem,
+and the deviation of the compiled losses and gradients from eager mode.
+
+    python bench_compile.py [problem] [NumSolsdir] [M] [NResi] [NSTEP]
+"""
+import sys
+import time
+from problems import Load, PROBLEMS
+
+import torch
+
+problem    = sys.argv[1] if len(sys.argv) > 1 else PROBLEMS[0]
+NumSolsdir = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] != '-' else None
+M          = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+NResi      = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+NSTEP      = int(sys.argv[5]) if len(sys.argv) > 5 else 200
+
+def run(Net, x, y, compiled):
+    if compiled:
+        Net.Compile()
+    optimizer = torch.optim.Adam(Net.parameters(), lr=1E-3)
+    losses = []
+    def step():
+        optimizer.zero_grad()
+        loss = Net.loss_PINN(x, y)
+        loss.backward()
+        optimizer.step()
+        return loss.item()
+    # warm up, which includes the compilation
+    tic = time.perf_counter()
+    losses.append(step())
+    warmup = time.perf_counter() - tic
+    tic = time.perf_counter()
+    for i in range(NSTEP):
+        losses.append(step())
+    return NSTEP/(time.perf_counter()-tic), warmup, losses
+
+if __name__ == '__main__':
+    Cases, roeqs = Load(problem, M, NumSolsdir)
+    inputs, outputs = Cases.GetResiData(roeqs, NResi)[0:2]
+    x = torch.tensor(inputs ).float().to(Cases.DEVICE)
+    y = torch.tensor(outputs).float().to(Cases.DEVICE)
+    layers = [x.shape[1], *[ Cases.Vars_dict['NetSize'] ]*3, M]
+    result = {}
+    for compiled in (False, True):
+        torch.manual_seed(1234)
+        Net = Cases.CustomedNet(layers=layers, roeqs=roeqs).to(Cases.DEVICE)
+        result[compiled] = run(Net, x, y, compiled)
+    (eager, _, loss0), (comp, warmup, loss1) = result[False], result[True]
+    print('%s, M=%d, NResi=%d'%(problem, M, NResi))
+    print('    eager    %9.1f steps/s'%eager)
+    print('    compiled %9.1f steps/s, %.2fx, %.1fs warm-up'%(comp, comp/eager, warmup))
+    print('    first loss %.8e / %.8e, max relative deviation over %d steps %.2e'\
+          %(loss0[0], loss1[0], NSTEP, max(abs(a-b)/abs(a) for a, b in zip(loss0, loss1))))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Benchmark
+Wall time of K seed nets of one problem trained one after another with
+train() and in lockstep with Ensemble.train_ensemble, on shared data.
+
+    python bench_ensemble.py [problem] [NumSolsdir] [Nettype] [K] [EPOCH] [M] [NResi]
+"""
+import sys
+import time
+from problems import Load, PROBLEMS
+
+problem    = sys.argv[1] if len(sys.argv) > 1 else PROBLEMS[0]
+NumSolsdir = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] != '-' else None
+Nettype    = sys.argv[3] if len(sys.argv) > 3 else 'Resi'
+K          = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+EPOCH      = int(sys.argv[5]) if len(sys.argv) > 5 else 50
+M          = int(sys.argv[6]) if len(sys.argv) > 6 else 5
+NResi      = int(sys.argv[7]) if len(sys.argv) > 7 else 2000
+
+Cases, roeqs = Load(problem, M, NumSolsdir)
+
+import os
+import tempfile
+import torch
+from NN import train
+from Ensemble import train_ensemble
+
+def Nets():
+    nets = []
+    for k in range(K):
+        torch.manual_seed(k)
+        nets.append( Cases.CustomedNet(layers=layers, roeqs=roeqs).to(Cases.DEVICE) )
+    return nets
+
+if __name__ == '__main__':
+    data = {'Label' : lambda: Cases.GetLabelData(roeqs),
+            'Resi'  : lambda: Cases.GetResiData(roeqs, NResi),
+            'Hybrid': lambda: Cases.GetHybridData(roeqs, NResi),}[Nettype]()
+    layers  = [data[-4].shape[1], *[ Cases.Vars_dict['NetSize'] ]*3, M]
+    options = Cases.train_options_default.copy()
+    options.update(EPOCH=EPOCH, epoch_print=EPOCH, weight_decay=0, patience=None,\
+                   NBATCH=1 if Nettype == 'Label' else 10)
+    tmpdir  = tempfile.mkdtemp()
+    netfiles = [os.path.join(tmpdir, '%d.net'%k) for k in range(K)]
+    torch.optim.Adam(Nets()[0].parameters())    # warm up the lazy imports of the optimizers
+    tic = time.perf_counter()
+    for Net, netfile in zip(Nets(), netfiles):
+        train(Net, data, netfile, options)
+    sequential = time.perf_counter() - tic
+    tic = time.perf_counter()
+    train_ensemble(Nets(), data, netfiles, options)
+    ensemble = time.perf_counter() - tic
+    print('%s %s, K=%d nets of %s, %d epochs'%(problem, Nettype, K, str(layers), EPOCH))
+    print('    sequential train   %8.2fs'%sequential)
+    print('    train_ensemble     %8.2fs, %.2fx'%(ensemble, sequential/ensemble))
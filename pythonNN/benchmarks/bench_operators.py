@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Benchmark
+Time of one Jacobian evaluation of the quadratic term, as in every Newton
+iteration of POD_G and every fprime call of POD_Gfsolve, on a random tensor
+A (lead, M, M, M) and one lamda (1, M):
+    dense  : the former (A + A^T) @ lamda, forming A + A^T on every call
+    gather : SymPackedTensor.jac unpacking S[:, P]*w on every call
+    packed : SymPackedTensor.jac with the Jacobian operator gathered once
+
+    python bench_operators.py [M,M,...] [lead] [NREP]
+"""
+import sys
+import os
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+from ReducedOperators import SymPackedTensor
+
+SIZES = [int(M) for M in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10, 20, 40]
+LEAD  = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+NREP  = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+def dense(A, lamda):
+    return np.matmul(A + np.swapaxes(A, -1, -2), lamda.T).squeeze(axis=-1)
+
+def gather(op, lamda):
+    n = lamda.shape[0]
+    J = (op.S[:, op.P]*op.w) @ lamda.T
+    return J.reshape((-1, n)).T.reshape((n,) + op.shape[:-3] + (op.M, op.M))
+
+def seconds(fun):
+    fun()
+    tic = time.perf_counter()
+    for i in range(NREP):
+        fun()
+    return (time.perf_counter() - tic)/NREP
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(1234)
+    print('%4s %12s %12s %12s %8s'%('M', 'dense', 'gather', 'packed', 'speedup'))
+    for M in SIZES:
+        A     = rng.randn(LEAD, M, M, M)
+        lamda = rng.randn(1, M)
+        op    = SymPackedTensor.Pack(A)
+        ref   = dense(A, lamda)
+        assert np.allclose(op.jac(lamda)[0], ref) and np.allclose(gather(op, lamda)[0], ref)
+        t = [seconds(lambda: dense(A, lamda)), seconds(lambda: gather(op, lamda)), seconds(lambda: op.jac(lamda))]
+        print('%4d %10.1fus %10.1fus %10.1fus %7.1fx'%(M, *(1E6*ti for ti in t), t[1]/t[2]))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Benchmark
+Peak memory and time of one forward+backward pass of the residual loss of a
+2D problem (loss_PINN of CustomedNet) for
+    dense   : the per-case operators sum_t cA_t*A_t, (n,M,M,M), and B, (n,M,M),
+              materialized as the losses did before AffineOperator.residual
+    lean    : AffineOperator.residual, contractions with (n,nA,M) intermediates
+    chunked : AffineOperator.residual with checkpointed chunks of the batch
+Every variant runs in its own process; the peak memory is the growth of the
+peak resident set size of the process during the pass.
+
+    python bench_residual_memory.py [problem] [NumSolsdir] [M] [NResi] [chunk]
+"""
+import sys
+import os
+import time
+import resource
+import subprocess
+from problems import Load
+
+problem    = sys.argv[1] if len(sys.argv) > 1 else '2DLidDriven'
+NumSolsdir = sys.argv[2] if len(sys.argv) > 2 else '-'
+M          = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+NResi      = int(sys.argv[4]) if len(sys.argv) > 4 else 1000
+chunk      = int(sys.argv[5]) if len(sys.argv) > 5 else 256
+VARIANTS   = ('dense', 'lean', 'chunked')
+
+def measure(variant):
+    import torch
+    Cases, roeqs = Load(problem, M, None if NumSolsdir == '-' else NumSolsdir)
+    x = torch.tensor(Cases.GetResiData(roeqs, NResi)[0]).float().to(Cases.DEVICE)
+    torch.manual_seed(1234)
+    Net = Cases.CustomedNet(layers=[x.shape[1], *[ Cases.Vars_dict['NetSize'] ]*3, M], roeqs=roeqs,\
+                            chunk=chunk if variant == 'chunked' else None).to(Cases.DEVICE)
+    if variant == 'dense':
+        A = torch.tensor(roeqs.Aop.dense()).float().to(Cases.DEVICE)
+        Aff = Net.Aff
+        def residual(lamda, cA, cB, chunk=None):
+            n = lamda.shape[0]
+            Ai = (cA[:,:,None,None,None]*A.reshape((1, -1, M, M, M))).sum(axis=1)
+            Bi = (cB[:,:,None,None]*Aff.B.reshape((1, -1, M, M))).sum(axis=1)
+            fx = (lamda[:,None,None,:] @ Ai @ lamda[:,None,:,None]).reshape((n, M))
+            return fx + (Bi @ lamda[:,:,None]).reshape((n, M)) + cB @ Aff.f
+        Net.Aff.residual = residual
+    # warm up on a few cases, which loads the lazily imported modules
+    chunk0, Net.chunk = Net.chunk, Net.chunk and 2
+    Net.loss_PINN(x[:4]).backward()
+    Net.chunk = chunk0; Net.zero_grad()
+    peak0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tic = time.perf_counter()
+    loss = Net.loss_PINN(x)
+    loss.backward()
+    walltime = time.perf_counter() - tic
+    peak1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('%.8e %.1f %.4f'%(loss.item(), (peak1-peak0)/1024, walltime))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 6:
+        measure(sys.argv[6])
+        sys.exit()
+    print('%s, M=%d, NResi=%d, chunk=%d'%(problem, M, NResi, chunk))
+    print('    %-8s %16s %12s %10s'%('variant', 'loss', 'peak [MB]', 'time [s]'))
+    for variant in VARIANTS:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), problem, NumSolsdir, str(M),\
+                              str(NResi), str(chunk), variant], capture_output=True, text=True)
+        if out.returncode != 0:
+            print('    %-8s failed: %s'%(variant, out.stderr.strip().splitlines()[-1]))
+            continue
+        loss, peak, walltime = out.stdout.split('\n')[-2].split()
+        print('    %-8s %16s %12s %10s'%(variant, loss, peak, walltime))
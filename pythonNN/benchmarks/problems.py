@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Benchmark setup
+Loads the reduced equations of one of the test problems the way its
+Cases_test.py does, for the benchmark scripts of this directory.
+Only one problem can be loaded per process, the case modules of the problems
+share their names.
+    problem    : 1DBurges, 2DLidDriven or 2DNaturalConvection
+    NumSolsdir : directory of the snapshots, the one of Cases_test by default
+"""
+import sys
+import os
+import importlib
+
+HERE     = os.path.dirname(os.path.abspath(__file__))
+PROBLEMS = ('1DBurges', '2DLidDriven', '2DNaturalConvection')
+MATFILES = {'2DLidDriven'        : ('LidDrivenPOD.mat', 'LidDrivenValidation.mat'),
+            '2DNaturalConvection': ('NaturalConvectionPOD.mat', 'NaturalConvectionValidation.mat'),}
+
+def Load(problem, M, NumSolsdir=None):
+    if problem not in PROBLEMS:
+        raise Exception('Unknown problem: ' + problem)
+    NumSolsdir = NumSolsdir and os.path.abspath(NumSolsdir)
+    os.chdir(os.path.join(HERE, '..', problem))
+    sys.path.insert(0,'../tools')
+    sys.path.insert(0,'../tools/NNs')
+    sys.path.insert(0,'.')
+    Cases = importlib.import_module('Cases_test')
+    NumSolsdir = NumSolsdir or Cases.NumSolsdir
+    if problem == '1DBurges':
+        matfile = NumSolsdir + '/'+'Burges1D_SampleNum='+str(Cases.Vars_dict['SampleNum'])+'.mat'
+        roeqs = Cases.CustomedEqs(matfile, M)
+    else:
+        matfilePOD, matfileValidation = (NumSolsdir + '/' + name for name in MATFILES[problem])
+        roeqs = Cases.CustomedEqs(matfilePOD, Cases.Vars_dict['SampleNum'], matfileValidation, M)
+    return Cases, roeqs
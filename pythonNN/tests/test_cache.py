@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the result cache of tools/NNs/Cache.py, run from pythonNN with
+python -m pytest tests
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'NNs'))
+import numpy as np
+import torch
+from Cache import ResultCache, CaseKey, Key, SourceDigest
+
+case    = {'SampleNum': 30, 'M': 5, 'Nettype': 'Label'}
+options = {'EPOCH': 100, 'LR': 0.01, 'lamda': lambda epoch: 0.96**(epoch//200), 'resume': False}
+data    = (np.arange(6.).reshape((3, 2)), np.ones((3, 1)), 'Label', 0.9)
+
+def test_key_follows_the_result():
+    code = SourceDigest(('Cache',), (CaseKey,))
+    key  = CaseKey(case, options, code, data=data)
+    assert CaseKey(dict(case), dict(options), code, data=data) == key
+    # options that do not change the result
+    assert CaseKey(case, dict(options, resume=True, epoch_print=10), code, data=data) == key
+    # everything else does
+    assert CaseKey(case, dict(options, LR=0.02), code, data=data) != key
+    assert CaseKey(case, dict(options, lamda=lambda epoch: 0.95**(epoch//200)), code, data=data) != key
+    assert CaseKey(dict(case, M=10), options, code, data=data) != key
+    assert CaseKey(case, options, code, data=(data[0]+1,) + data[1:]) != key
+    assert CaseKey(case, options, Key(code=code, other=1), data=data) != key
+
+def test_key_follows_the_input_files(tmp_path):
+    file = str(tmp_path/'snapshots.mat')
+    with open(file, 'w') as f:
+        f.write('a')
+    key = CaseKey(case, options, 'code', files=[file])
+    with open(file, 'w') as f:
+        f.write('b')
+    # a new mtime, so the digest is computed again
+    os.utime(file, ns=(1, 1))
+    assert CaseKey(case, options, 'code', files=[file]) != key
+
+def test_cache_hit_and_miss(tmp_path):
+    cache   = ResultCache(str(tmp_path/'cache'))
+    netfile = str(tmp_path/'a.net')
+    key     = CaseKey(case, options, 'code', data=data)
+    assert cache.load(key, netfile) is None
+    torch.save({'weights': 1}, netfile)
+    cache.store(key, ([1., 2.], [3.]), netfile)
+    # another configuration trains into the same file
+    other = CaseKey(case, dict(options, LR=0.02), 'code', data=data)
+    assert cache.load(other, netfile) is None
+    torch.save({'weights': 2}, netfile)
+    with open(netfile + '.state', 'w') as f:
+        f.write('state of the other configuration')
+    # the hit restores the net of key and drops the training state of other
+    assert cache.load(key, netfile) == ([1., 2.], [3.])
+    assert torch.load(netfile) == {'weights': 1} and not os.path.isfile(netfile + '.state')
+    with open(netfile + '.key') as f:
+        assert f.read().strip() == key
+
+def test_claim_drops_the_state_of_another_key(tmp_path):
+    cache   = ResultCache(str(tmp_path/'cache'))
+    netfile = str(tmp_path/'a.net')
+    cache.claim('key1', netfile)
+    with open(netfile + '.state', 'w') as f:
+        f.write('state of key1')
+    cache.claim('key1', netfile)
+    assert os.path.isfile(netfile + '.state')
+    cache.claim('key2', netfile)
+    assert not os.path.isfile(netfile + '.state')
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the checkpoints of tools/NNs/Checkpoint.py, run from pythonNN with
+python -m pytest tests
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'NNs'))
+import threading
+import pytest
+import torch
+import Checkpoint
+from Checkpoint import AtomicSave, CheckpointWriter
+
+
+def test_writer_writes_the_latest_snapshot(tmp_path):
+    file = str(tmp_path/'a.pt')
+    x = torch.zeros(3)
+    writer = CheckpointWriter()
+    for i in range(5):
+        x += 1
+        writer.save(file, {'x': x, 'i': i})
+    # save snapshots: later changes of x are not written
+    x += 100
+    writer.close()
+    state = torch.load(file, weights_only=False)
+    assert state['i'] == 4 and torch.equal(state['x'], torch.full((3,), 5.))
+    assert not writer.thread.is_alive()
+    assert os.listdir(str(tmp_path)) == ['a.pt']
+
+def test_writer_coalesces_pending_saves(tmp_path, monkeypatch):
+    # while the first file is written, the saves of the second are coalesced
+    written, gate = [], threading.Event()
+    def save(obj, file):
+        gate.wait(10)
+        written.append((os.path.basename(file), obj['i']))
+    monkeypatch.setattr(Checkpoint, 'AtomicSave', save)
+    writer = CheckpointWriter()
+    writer.save(str(tmp_path/'a.pt'), {'i': 0})
+    for i in range(1, 4):
+        writer.save(str(tmp_path/'b.pt'), {'i': i})
+    gate.set()
+    writer.close()
+    assert written == [('a.pt', 0), ('b.pt', 3)]
+
+def test_writer_raises_the_write_error(tmp_path, monkeypatch):
+    def save(obj, file):
+        raise OSError('disk full')
+    monkeypatch.setattr(Checkpoint, 'AtomicSave', save)
+    writer = CheckpointWriter()
+    writer.save(str(tmp_path/'a.pt'), {'i': 0})
+    with pytest.raises(OSError):
+        writer.close()
+    # the thread is stopped anyway
+    assert not writer.thread.is_alive()
+
+def test_atomic_save_keeps_the_old_file(tmp_path):
+    file = str(tmp_path/'a.pt')
+    AtomicSave({'i': 0}, file)
+    with pytest.raises(Exception):
+        AtomicSave({'f': lambda x: x}, file)    # not picklable
+    assert torch.load(file, weights_only=False) == {'i': 0}
+    assert os.listdir(str(tmp_path)) == ['a.pt']
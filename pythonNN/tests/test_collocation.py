@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the residual-based resampling of tools/NNs/Collocation.py, run from
+pythonNN with python -m pytest tests
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'NNs'))
+import numpy as np
+import torch
+from Collocation import Resampler
+
+
+class ResiNet():
+    # loss_PINN of a net whose residual at x is x itself
+    def loss_PINN(self, x, y, w):
+        return ((w*x)**2).mean()
+
+def Sampler(N):
+    # the candidates 0..N-1, the residual grows with the index
+    x = np.arange(N, dtype=float)[:, None]
+    return x, np.zeros_like(x)
+
+def Trainset(n):
+    return tuple(torch.zeros((n, 1)) for i in range(3))
+
+def test_score_is_the_squared_residual():
+    x = torch.arange(5.)[:, None]
+    score = Resampler(Sampler, chunk=2).Score(ResiNet(), x, torch.zeros_like(x))
+    assert np.allclose(score, 2*np.arange(5.)**2)
+
+def test_rar_adds_the_largest_residuals():
+    resampler = Resampler(Sampler, mode='RAR', pool=20, nadd=3)
+    new = resampler.Update(ResiNet(), Trainset(10), lambda x: 0.5*np.ones((x.shape[0], 1)))
+    assert new[0].shape[0] == 13
+    assert sorted(new[0][10:, 0].tolist()) == [17., 18., 19.]
+    assert torch.all(new[2][10:] == 0.5)
+
+def test_rad_redraws_by_residual():
+    np.random.seed(0)
+    resampler = Resampler(Sampler, mode='RAD', pool=100, k=1, c=0)
+    new = resampler.Update(ResiNet(), Trainset(50), lambda x: np.ones((x.shape[0], 1)))
+    assert all(t.shape[0] == 50 for t in new)
+    # p ~ r: the candidate 0 has no residual and is never drawn
+    assert new[0].min() > 0 and new[0].mean() > 49.5
+
+def test_rad_small_pool():
+    # fewer candidates of nonzero probability than training points
+    np.random.seed(0)
+    resampler = Resampler(Sampler, mode='RAD', pool=5, c=0)
+    new = resampler.Update(ResiNet(), Trainset(20), lambda x: np.ones((x.shape[0], 1)))
+    assert new[0].shape[0] == 20 and set(new[0][:, 0].tolist()) <= {1., 2., 3., 4.}
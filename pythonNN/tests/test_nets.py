@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of starting POD_Nets of tools/NNs/NN.py from trained nets, run from
+pythonNN with python -m pytest tests
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'NNs'))
+import pytest
+import torch
+from NN import POD_Net
+
+
+class NormNet(POD_Net):
+    # a net with the output normalization of CustomedNet
+    def __init__(self, layers):
+        super(NormNet, self).__init__(layers=layers)
+        M = [width for width in layers if not isinstance(width, str)][-1]
+        self.proj_mean = torch.randn(1, M)
+        self.proj_std  = torch.rand(1, M) + 0.5
+    def forward(self, x):
+        return self.mlp(x)*self.proj_std + self.proj_mean
+
+def test_grow_keeps_the_first_outputs(tmp_path):
+    torch.manual_seed(0)
+    old = NormNet([2, 10, 10, 3])
+    old.savenet(str(tmp_path/'old.net'))
+    new = NormNet([2, 10, 10, 5])
+    new.grow(str(tmp_path/'old.net'))
+    x = torch.randn(20, 2)
+    with torch.no_grad():
+        assert torch.allclose(new(x)[:, :3], old(x), atol=1E-6)
+        # the new outputs start near the mean of their coefficients
+        assert torch.allclose(new(x)[:, 3:], new.proj_mean[:, 3:], atol=0.1)
+
+def test_grow_needs_the_same_hidden_layers(tmp_path):
+    torch.manual_seed(0)
+    NormNet([2, 10, 10, 3]).savenet(str(tmp_path/'old.net'))
+    for layers in ([2, 10, 3, 5], [2, 10, 10, 2], [2, 10, 10, 5, 'tanh']):
+        with pytest.raises(Exception):
+            NormNet(layers).grow(str(tmp_path/'old.net'))
+    # the default activation by its name is the same net
+    NormNet([2, 10, 10, 5, 'swish']).grow(str(tmp_path/'old.net'))
+
+def test_warmstart_predicts_as_the_old_net(tmp_path):
+    torch.manual_seed(0)
+    old = NormNet([2, 10, 10, 3])
+    old.savenet(str(tmp_path/'old.net'))
+    new = NormNet([2, 10, 10, 3, 'swish'])
+    new.warmstart(str(tmp_path/'old.net'))
+    x = torch.randn(20, 2)
+    with torch.no_grad():
+        assert torch.equal(new(x), old(x))
+    for layers in ([2, 10, 10, 4], [2, 10, 10, 3, 'tanh']):
+        with pytest.raises(Exception):
+            NormNet(layers).warmstart(str(tmp_path/'old.net'))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the reduced operators of tools/ReducedOperators.py against the dense
+einsum of the cubic Galerkin tensor, run from pythonNN with
+python -m pytest tests
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+import numpy as np
+import torch
+from ReducedOperators import SymPackedTensor, LowRankTensor, AffineOperator
+
+
+def Dense(A, lamda):
+    # quad and jac of the dense tensor A (..., M, M, M)
+    quad = np.einsum('...kij,ni,nj->n...k', A, lamda, lamda)
+    jac  = np.einsum('...kij,nj->n...ki', A + np.swapaxes(A, -1, -2), lamda)
+    return quad, jac
+
+def test_sympacked_equals_dense():
+    rng = np.random.RandomState(0)
+    A, lamda = rng.randn(4, 7, 7, 7), rng.randn(5, 7)
+    op = SymPackedTensor.Pack(A)
+    quad, jac = Dense(A, lamda)
+    assert np.allclose(op.quad(lamda), quad)
+    assert np.allclose(op.jac(lamda), jac)
+    assert np.allclose(op.dense(), (A + np.swapaxes(A, -1, -2))/2)
+    # the Jacobian operator is gathered once and reused
+    J = op.J
+    assert J is not None and np.allclose(op.jac(2*lamda), 2*jac) and op.J is J
+
+def test_sympacked_case_and_torch():
+    rng = np.random.RandomState(1)
+    A, lamda, c = rng.randn(3, 6, 6, 6), rng.randn(4, 6), rng.randn(2, 3)
+    op = SymPackedTensor.Pack(A)
+    op.jac(lamda)
+    # the combined operators must not reuse the Jacobian of op
+    case = op.Combine(c).Case(1)
+    quad, jac = Dense(np.einsum('t,tkij->kij', c[1], A), lamda)
+    assert np.allclose(case.quad(lamda), quad) and np.allclose(case.jac(lamda), jac)
+    top = op.to('cpu')
+    quad, jac = Dense(A, lamda)
+    x = torch.tensor(lamda).float()
+    assert np.allclose(top.quad(x).numpy(), quad, atol=1E-4)
+    assert np.allclose(top.jac(x).numpy(), jac, atol=1E-4)
+
+def LowRankData(rng, ranks=(3, 2, 2), lead=2, M=6):
+    # a tensor (lead, M, M, M) of exact Tucker ranks
+    G = rng.randn(*ranks)
+    U = [rng.randn(lead*M, ranks[0]), rng.randn(M, ranks[1]), rng.randn(M, ranks[2])]
+    return np.einsum('abc,ka,ib,jc->kij', G, *U).reshape((lead, M, M, M))
+
+def test_tucker_equals_dense():
+    rng = np.random.RandomState(2)
+    A, lamda = LowRankData(rng), rng.randn(5, 6)
+    op = LowRankTensor(A, tol=1E-8, method='tucker')
+    assert op.error < 1E-8 and op.rank == (3, 2, 2)
+    quad, jac = Dense(A, lamda)
+    assert np.allclose(op.quad(lamda), quad) and np.allclose(op.jac(lamda), jac)
+
+def test_cp_equals_dense():
+    rng = np.random.RandomState(3)
+    U = [rng.randn(6, 2), rng.randn(6, 2), rng.randn(6, 2)]
+    A, lamda = np.einsum('kr,ir,jr->kij', *U)[None], rng.randn(5, 6)
+    op = LowRankTensor(A, tol=1E-6, method='cp')
+    assert op.error < 1E-6
+    quad, jac = Dense(op.dense(), lamda)
+    assert np.allclose(op.quad(lamda), quad) and np.allclose(op.jac(lamda), jac)
+    assert np.allclose(op.quad(lamda), Dense(A, lamda)[0], atol=1E-4*np.abs(quad).max())
+
+def test_lowrank_combine_and_truncation():
+    rng = np.random.RandomState(4)
+    A, lamda, c = LowRankData(rng, lead=3), rng.randn(4, 6), rng.randn(2, 3)
+    case = LowRankTensor(A, tol=1E-8).Combine(c).Case(0)
+    quad, jac = Dense(np.einsum('t,tkij->kij', c[0], A), lamda)
+    assert np.allclose(case.quad(lamda), quad) and np.allclose(case.jac(lamda), jac)
+    # a loose tolerance truncates and reports the error reached
+    op = LowRankTensor(A + 1E-3*rng.randn(*A.shape), tol=1E-1)
+    assert op.error <= 1E-1 and np.prod(op.rank) < 3*6*6*6
+
+def test_affine_equals_dense():
+    # sum_t cA_t*lamda^T A_t lamda + sum_t cB_t*(B_t lamda + f_t) of every case
+    rng = np.random.RandomState(5)
+    nA, nB, M, n = 3, 4, 5, 6
+    A, B, f = rng.randn(nA, M, M, M), rng.randn(nB, M, M), rng.randn(nB, M)
+    lamda, cA, cB = rng.randn(n, M), rng.randn(n, nA), rng.randn(n, nB)
+    ref = np.einsum('nt,tkij,ni,nj->nk', cA, A, lamda, lamda) \
+         +np.einsum('nt,tkj,nj->nk', cB, B, lamda) + cB @ f
+    for Aop in (SymPackedTensor.Pack(A), LowRankTensor(A, tol=1E-10)):
+        Aff = AffineOperator(Aop, B, f)
+        assert np.allclose(Aff.residual(lamda, cA, cB), ref)
+        assert np.allclose(Aff.residual(lamda, cA, cB, chunk=4), ref)
+        # the operators of a batch of cases, as in POD_Gfsolve
+        Ai, Bi, fi = Aff.Assemble(cA, cB)
+        for i in range(n):
+            Ri = Ai.Case(i).quad(lamda[i:i+1])[0] + Bi[i] @ lamda[i] + fi[i]
+            assert np.allclose(Ri, ref[i])
+    # torch, chunked with autograd as in the losses
+    Aff = AffineOperator(SymPackedTensor.Pack(A), B, f).to('cpu')
+    x = torch.tensor(lamda).float().requires_grad_()
+    R = Aff.residual(x, torch.tensor(cA).float(), torch.tensor(cB).float(), chunk=4)
+    assert np.allclose(R.detach().numpy(), ref, atol=1E-4)
+    R.sum().backward()
+    assert x.grad is not None and x.grad.shape == x.shape
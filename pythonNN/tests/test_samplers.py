@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the samplers of the design space of tools/Samplers.py, run from
+pythonNN with python -m pytest tests
+"""
+import os
+import sys
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools', 'NNs'))
+import numpy as np
+import pytest
+from Samplers import Samples, Smolyak, SmolyakLevel, METHODS
+
+design_space = np.array([[1E4, 0.6, 45], [1E5, 0.8, 90]])
+
+def test_default_is_the_former_random_points():
+    np.random.seed(1234)
+    points = Samples(design_space, 100)
+    np.random.seed(1234)
+    x = np.random.rand(100, 3)*2 - 1
+    former = (x + 1)/2*(design_space[1:2] - design_space[0:1]) + design_space[0:1]
+    assert np.allclose(points, former)
+
+@pytest.mark.parametrize('method', METHODS)
+def test_points_in_design_space(method):
+    np.random.seed(0)
+    points = Samples(design_space, 64, method)
+    assert points.shape[1] == 3 and points.shape[0] <= 64
+    assert np.all(points >= design_space[0] - 1E-9) and np.all(points <= design_space[1] + 1E-9)
+    np.random.seed(0)
+    assert np.array_equal(points, Samples(design_space, 64, method))
+
+def test_smolyak_levels():
+    assert Smolyak(3, 1).shape == (1, 3)
+    assert Smolyak(3, 2).shape == (7, 3)
+    assert Smolyak(3, 3).shape == (25, 3)
+    # N is the number of points, not the level
+    assert SmolyakLevel(3, 20000) < 20 and Samples(design_space, 20000, 'smolyak').shape[0] <= 20000
+    assert Samples(design_space, 0, 'smolyak', level=3).shape == (25, 3)
+    with pytest.raises(Exception):
+        Smolyak(3, 0)
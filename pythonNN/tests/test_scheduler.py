@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the sweep scheduler of tools/NNs/Scheduler.py, run from pythonNN
+with python -m pytest tests
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'NNs'))
+import time
+from Scheduler import Sweep
+
+
+def Run(job):
+    # the jobs of the tests: (action, value), run in the worker processes
+    action, value = job
+    print('job', action, value)
+    if action == 'fail':
+        raise ValueError(value)
+    if action == 'exit':
+        os._exit(3)
+    time.sleep(value)
+    return (value, os.environ['POD_DEVICE'], os.environ['POD_WORKER'], time.time())
+
+def test_sweep_runs_the_dependencies_first(tmp_path):
+    jobs = [('b', ('sleep', 0.0), ['a']),
+            ('a', ('sleep', 0.5), []),
+            ('c', ('sleep', 0.0), ['b', 'unknown'])]
+    done, failed = Sweep(Run, jobs, workers=2, devices=['cpu'], threads=1, logdir=str(tmp_path))
+    assert list(done) == ['b', 'a', 'c'] and not failed
+    assert done['a'][3] < done['b'][3] < done['c'][3]
+    assert {result[1] for result in done.values()} == {'cpu'}
+    with open(str(tmp_path/'a.out')) as f:
+        assert f.read() == 'job sleep 0.5\n'
+
+def test_sweep_skips_the_dependents_of_failed_jobs(tmp_path):
+    jobs = [('a', ('fail', 'bad case'), []),
+            ('b', ('sleep', 0.0), ['a']),
+            ('c', ('exit', None), []),
+            ('d', ('sleep', 0.0), ['c']),
+            ('e', ('sleep', 0.0), [])]
+    done, failed = Sweep(Run, jobs, workers=2, devices=['cpu'], threads=1)
+    assert list(done) == ['e']
+    assert 'ValueError: bad case' in failed['a'] and 'exited with code 3' in failed['c']
+    assert failed['b'].startswith('skipped') and failed['d'].startswith('skipped')
+
+def test_sweep_reports_circular_dependencies():
+    jobs = [('a', ('sleep', 0.0), ['b']), ('b', ('sleep', 0.0), ['a']), ('c', ('sleep', 0.0), [])]
+    done, failed = Sweep(Run, jobs, workers=1, devices=['cpu'], threads=1)
+    assert list(done) == ['c'] and sorted(failed) == ['a', 'b']
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the training loop of tools/NNs/NN.py and its batching, on a small net
+without a reduced model, run from pythonNN with python -m pytest tests
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools', 'NNs'))
+import types
+import numpy as np
+import pytest
+import torch
+import NN
+from NN import POD_Net, train, train_options_default, Batcher, random_split
+
+
+class LabelNet(POD_Net):
+    # the projection loss of CustomedNet, without the normalization
+    def loss_NN(self, x, y):
+        return self.lossfun(self.mlp(x), y)
+
+def LabelData(n=64):
+    x = np.random.rand(n, 2)*2 - 1
+    return (x, np.sin(x[:, :1]) + x[:, 1:]**2, 'Label', 0.75)
+
+def Options(**values):
+    options = train_options_default.copy()
+    options.update(weight_decay=0, NBATCH=1, epoch_print=1000, async_save=False)
+    options.update(values)
+    return options
+
+
+def test_adam_plateau_starts_lbfgs(tmp_path, capsys):
+    # with LR = 0 Adam never improves on the starting weights, the plateau after
+    # patience epochs starts the L-BFGS stage instead of stopping the training
+    torch.manual_seed(0); np.random.seed(0)
+    Net = LabelNet(layers=[2, 10, 10, 1])
+    train_history, test_history = train(Net, LabelData(), str(tmp_path/'a.net'), \
+        Options(EPOCH=100, LR=0, patience=5, stop_start=0, LBFGS_EPOCH=3))
+    out = capsys.readouterr().out
+    assert '|no improvement since epoch 0, end Adam at epoch 5' in out
+    assert '|switch to full-batch L-BFGS at epoch 6' in out
+    # the L-BFGS epochs 6..8 ran and improved on the starting loss, then stopped
+    assert np.all(train_history[6:9] > 0) and np.all(train_history[9:] == 0)
+    assert test_history[8, 0] < test_history[0, 0]
+    state = torch.load(str(tmp_path/'a.net.state'), weights_only=False)
+    assert state['finished'] and state['lbfgs'] and state['switch'] == 6
+
+def test_plateau_without_lbfgs_stops(tmp_path, capsys):
+    torch.manual_seed(0); np.random.seed(0)
+    Net = LabelNet(layers=[2, 10, 10, 1])
+    train_history, test_history = train(Net, LabelData(), str(tmp_path/'a.net'), \
+        Options(EPOCH=100, LR=0, patience=5, stop_start=0))
+    assert '|stop at epoch 5' in capsys.readouterr().out
+    assert np.all(train_history[6:] == 0)
+
+def test_bfloat16_check_falls_back(monkeypatch):
+    # without the private mkldnn check MixedPrecision keeps float32
+    monkeypatch.setattr(torch, 'ops', types.SimpleNamespace())
+    monkeypatch.setattr(NN, 'DEVICE', torch.device('cpu'))
+    Net = LabelNet(layers=[2, 10, 1])
+    with pytest.warns(UserWarning):
+        assert Net.MixedPrecision().autocast is None
+
+def test_batcher_covers_every_row_once():
+    x = torch.arange(10.)[:, None]
+    y = 2*x
+    batcher = Batcher((x, y), batch_size=4)
+    assert len(batcher) == 3
+    torch.manual_seed(0)
+    batches = list(batcher)
+    assert [b[0].shape[0] for b in batches] == [4, 4, 2]
+    rows = torch.cat([b[0] for b in batches])[:, 0]
+    assert sorted(rows.tolist()) == list(range(10)) and rows.tolist() != list(range(10))
+    # the tensors are permuted together
+    assert all(torch.equal(2*bx, by) for bx, by in batches)
+    assert [b[0][:, 0].tolist() for b in Batcher((x,), 6, shuffle=False)] == [list(range(6)), list(range(6, 10))]
+    train, test = random_split((x, y), 7)
+    assert train[0].shape[0] == 7 and sorted(torch.cat((train[0], test[0]))[:, 0].tolist()) == list(range(10))
+    assert torch.equal(2*train[0], train[1])
+
+def test_resume_equals_uninterrupted(tmp_path, capsys):
+    # a run interrupted in epoch 4 and resumed from netfile.state ends with
+    # the weights and histories of the uninterrupted run
+    crash = {'epoch': None}
+    def lamda(epoch):
+        if epoch == crash['epoch']:
+            raise RuntimeError('interrupted')
+        return 0.9**epoch
+    options = Options(EPOCH=8, NBATCH=2, epoch_save=1, lamda=lamda)
+    def Run(netfile, seed=0, **values):
+        torch.manual_seed(seed); np.random.seed(seed)
+        Net = LabelNet(layers=[2, 10, 10, 1])
+        histories = train(Net, LabelData(), str(tmp_path/netfile), dict(options, **values))
+        return Net, histories
+    Net0, (train0, test0) = Run('a.net')
+    crash['epoch'] = 5     # the scheduler step at the end of epoch 4
+    with pytest.raises(RuntimeError):
+        Run('b.net')
+    crash['epoch'] = None
+    # another seed: the data, weights and random state all come from the state
+    Net1, (train1, test1) = Run('b.net', seed=1, resume=True)
+    assert '|resume %s from epoch 4'%(tmp_path/'b.net') in capsys.readouterr().out
+    assert all(torch.equal(v, Net1.state_dict()[k]) for k, v in Net0.state_dict().items())
+    assert np.array_equal(train0, train1) and np.array_equal(test0, test1)
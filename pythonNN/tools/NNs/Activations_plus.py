@@ -1,10 +1,69 @@
+"""
+@Activations
+Registry of the activations of POD_Net, selected by name as the last entry of
+layers, e.g. layers = [2, 50, 50, 50, 5, 'tanh'] (Swish without a name):
+    swish  :: x*sigmoid(x), a custom autograd function that keeps only x for
+              the backward pass and recomputes the sigmoid there, instead of
+              the two intermediates x and sigmoid(x) of the plain product;
+              forward and backward run the fused kernels of silu
+    silu   :: torch.nn.SiLU, the same function as the built-in kernel
+    tanh   :: torch.nn.Tanh
+    sin    :: sin(x)
+    adaptive_<name> :: <name>(n*a*x) with a trainable slope a per layer,
+              initialized to 1/n (adaptive activations, n = 10)
+"""
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
 Sigmoid = nn.Sigmoid()
+
+class SwishFunction(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x):
+        ctx.save_for_backward(x)
+        return F.silu(x)
+
+    @staticmethod
+    def backward(ctx, grad):
+        # d(x*s)/dx = s*(1 + x*(1-s)) with s = sigmoid(x) recomputed, by the
+        # fused kernel of silu; that kernel has no derivative, so a backward
+        # pass that is differentiated itself (create_graph) uses the formula
+        x, = ctx.saved_tensors
+        if torch.is_grad_enabled():
+            s = torch.sigmoid(x)
+            return grad * s * (1 + x * (1 - s))
+        return torch.ops.aten.silu_backward(grad, x)
+
 class Swish(nn.Module):
     def __init__(self):
         super(Swish, self).__init__()
- 
+
     def forward(self, x):
-        x = x * Sigmoid(x)
-        return x
-    
\ No newline at end of file
+        return SwishFunction.apply(x)
+
+class Sin(nn.Module):
+    def forward(self, x):
+        return torch.sin(x)
+
+class AdaptiveSlope(nn.Module):
+    def __init__(self, activation, n=10):
+        super(AdaptiveSlope, self).__init__()
+        self.activation = activation
+        self.n     = n
+        self.slope = nn.Parameter(torch.tensor(1.0/n))
+
+    def forward(self, x):
+        return self.activation(self.n*self.slope*x)
+
+ACTIVATIONS = {'swish': Swish,
+               'silu' : nn.SiLU,
+               'tanh' : nn.Tanh,
+               'sin'  : Sin,}
+
+def Activation(name):
+    # a new activation module of the registered name
+    if name.startswith('adaptive_') and name[len('adaptive_'):] in ACTIVATIONS:
+        return AdaptiveSlope(ACTIVATIONS[name[len('adaptive_'):]]())
+    if name not in ACTIVATIONS:
+        raise Exception('Unknown activation: ' + name)
+    return ACTIVATIONS[name]()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+@Result cache
+Content-addressed cache of the trained cases of a sweep. The key of a case is
+the sha256 of everything its result depends on:
+    - the case dict, the training data and the training options, with
+      functions by their source and arrays by their digest; the options that
+      do not change the result (VOLATILE, e.g. resume, profile) are left out
+    - the code: the source files of the modules and the source of the
+      functions given, e.g. CaseSim; other modules and commits do not count
+    - the digests of the input files: the snapshots, the validation data and
+      the net a warm started or grown net starts from
+A case with an entry <dir>/<key>.pt is not trained again, its result is read
+from the entry and its net file restored from the bytes of the entry, in case
+another configuration wrote it. Any change of the above gives a new key, so
+only the cases it concerns are trained again; the entries of old keys are
+kept, going back to a former configuration trains nothing.
+netfile.key records the key the net file and its training state belong to; an
+interrupted training of another key is not resumed.
+"""
+import os
+import sys
+import json
+import hashlib
+import inspect
+import tempfile
+import numpy as np
+import torch
+from Checkpoint import AtomicSave
+
+VOLATILE = ('resume', 'async_save', 'profile', 'profile_trace', 'epoch_print', 'epoch_save')
+DIGESTS  = {}
+
+def FileDigest(file):
+    # sha256 of the content of file, computed once per (size, mtime)
+    stat = os.stat(file)
+    name = (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+    if name not in DIGESTS:
+        digest = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+        DIGESTS[name] = digest.hexdigest()
+    return DIGESTS[name]
+
+def Source(fun):
+    try:
+        return inspect.getsource(fun)
+    except (OSError, TypeError):
+        # defined interactively: the bytecode
+        return hashlib.sha256(fun.__code__.co_code).hexdigest()
+
+def SourceDigest(modules=(), functions=()):
+    # digest of the source files of the modules (names) and of the functions
+    return Key(modules  = {name: FileDigest(sys.modules[name].__file__) for name in modules},
+               functions= [Source(fun) for fun in functions])
+
+def Canonical(obj):
+    """obj as JSON data that is equal for equal values: functions by their
+       source, arrays by their digest, other objects by their class and
+       attributes
+    """
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return obj
+    if isinstance(obj, float):
+        return repr(obj)
+    if isinstance(obj, np.generic):
+        return Canonical(obj.item())
+    if isinstance(obj, dict):
+        return {str(key): Canonical(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [Canonical(value) for value in obj]
+    if torch.is_tensor(obj):
+        obj = obj.detach().cpu().numpy()
+    if isinstance(obj, np.ndarray):
+        return {'array': [str(obj.dtype), list(obj.shape)], \
+                'sha256': hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()}
+    if inspect.ismethod(obj):
+        return {'method': Source(obj.__func__), 'self': Canonical(obj.__self__)}
+    if inspect.isfunction(obj):
+        return {'function': Source(obj)}
+    if hasattr(obj, '__dict__'):
+        return {'class': type(obj).__qualname__, 'vars': Canonical(vars(obj))}
+    return repr(obj)
+
+def Key(**parts):
+    # sha256 of the parts, keyword arguments of any kind Canonical takes
+    data = json.dumps(Canonical(parts), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def CaseKey(case, options, code, files=(), data=None):
+    # the key of a case trained on data with options, code from SourceDigest
+    options = {name: value for name, value in options.items() if name not in VOLATILE}
+    return Key(case=case, options=options, code=code, files=[FileDigest(file) for file in files], data=data)
+
+
+class ResultCache():
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def file(self, key):
+        return os.path.join(self.dirname, key + '.pt')
+
+    def load(self, key, netfile=None):
+        """the cached result of key, None if there is none; its net is
+           written to netfile unless netfile holds it already
+        """
+        if not os.path.isfile(self.file(key)):
+            return None
+        entry = torch.load(self.file(key), map_location='cpu', weights_only=False)
+        if netfile is not None:
+            if not os.path.isfile(netfile) or FileDigest(netfile) != entry['net_sha256']:
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(netfile)), suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(entry['net'])
+                os.replace(tmp, netfile)
+                # the training state of the former net, see NN.Finished
+                if os.path.isfile(netfile + '.state'):
+                    os.remove(netfile + '.state')
+            self.claim(key, netfile)
+        return entry['result']
+
+    def claim(self, key, netfile):
+        """netfile is (being) trained for key; an unfinished training state
+           of another key is removed, so that train does not resume it
+        """
+        keyfile = netfile + '.key'
+        old = open(keyfile).read().strip() if os.path.isfile(keyfile) else None
+        if old != key:
+            if old is not None and os.path.isfile(netfile + '.state'):
+                os.remove(netfile + '.state')
+            with open(keyfile, 'w') as f:
+                f.write(key + '\n')
+
+    def store(self, key, result, netfile, **info):
+        # the result of key and the net of netfile, with info for inspection
+        os.makedirs(self.dirname, exist_ok=True)
+        with open(netfile, 'rb') as f:
+            net = f.read()
+        AtomicSave({'result': result, 'net': net, 'net_sha256': hashlib.sha256(net).hexdigest(), \
+                    'netfile': os.path.basename(netfile), **info}, self.file(key))
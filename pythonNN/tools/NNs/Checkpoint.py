@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+@Checkpoints
+AtomicSave        :: torch.save to a temporary file in the target directory,
+                     renamed over the target, so a crash never leaves a
+                     truncated file behind
+CheckpointWriter  :: writes checkpoints on a background thread; save() only
+                     snapshots the tensors to CPU memory, and pending saves of
+                     the same file are coalesced so that only the latest one
+                     is written
+RNGState          :: the states of the random generators (torch, numpy,
+                     random), restored by SetRNGState when a run is resumed;
+                     Seed seeds them all
+"""
+import os
+import random
+import tempfile
+import threading
+import numpy as np
+import torch
+
+
+def RNGState():
+    state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'random': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def SetRNGState(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def Seed(seed):
+    torch.manual_seed(seed)     # and cuda
+    np.random.seed(seed % 2**32)
+    random.seed(seed)
+
+def Snapshot(obj):
+    # copy of obj with all tensors detached and copied to CPU memory
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, Snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(Snapshot(value) for value in obj)
+    return obj
+
+def AtomicSave(obj, file):
+    dirname, basename = os.path.split(os.path.abspath(file))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.'+basename, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, file)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class CheckpointWriter():
+    def __init__(self):
+        self.pending = {}       # file -> the latest snapshot to write
+        self.writing = False
+        self.closed  = False
+        self.error   = None
+        self.cond    = threading.Condition()
+        self.thread  = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, file, obj):
+        self._raise()
+        snapshot = Snapshot(obj)
+        with self.cond:
+            self.pending[file] = snapshot
+            self.cond.notify_all()
+
+    def flush(self):
+        # wait until all pending checkpoints are written
+        with self.cond:
+            while (self.pending or self.writing) and self.error is None:
+                self.cond.wait()
+        self._raise()
+
+    def close(self):
+        # the thread is stopped also when a write failed, the error is raised
+        try:
+            self.flush()
+        finally:
+            with self.cond:
+                self.closed = True
+                self.cond.notify_all()
+            self.thread.join()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                file = next(iter(self.pending))
+                obj  = self.pending.pop(file)
+                self.writing = True
+            try:
+                AtomicSave(obj, file)
+            except Exception as e:
+                self.error = e
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+@Adaptive collocation
+Residual-based resampling of the residual points of the Resi and Hybrid nets,
+called by train() every <epoch> epochs:
+    RAR :: residual-based adaptive refinement, the nadd candidates with the
+           largest residual are added to the training points
+    RAD :: residual-based adaptive distribution, the training points are
+           redrawn from the candidates with probability
+               p ~ r^k/mean(r^k) + c
+where r is the squared residual norm of a candidate under the current net and
+the candidates are a fresh pool of <pool> points from sampler.
+"""
+import numpy as np
+import torch
+
+
+class Resampler():
+    def __init__(self, sampler, mode='RAD', epoch=500, pool=None, nadd=None, k=1, c=1, chunk=10000):
+        """sampler(N) returns N new residual points as (inputs, outputs), like
+           GetResiData of the cases; pool defaults to 10 times the training
+           points and nadd (RAR) to a tenth of them
+        """
+        if mode not in ('RAR', 'RAD'):
+            raise Exception('Unknown resampling mode: ' + mode)
+        self.sampler = sampler
+        self.mode    = mode
+        self.epoch   = epoch
+        self.pool    = pool
+        self.nadd    = nadd
+        self.k, self.c = k, c
+        self.chunk   = chunk
+
+    def Score(self, Net, x, y):
+        # loss_PINN(x,y,w) = mean( (w*fx)^2 ), so d(loss)/dw_i at w = 1 is
+        # proportional to the squared residual norm of the point i; only w is
+        # differentiated, the net is not backpropagated
+        score = []
+        for i in range(0, x.shape[0], self.chunk):
+            xi, yi = x[i:i+self.chunk], y[i:i+self.chunk]
+            w = torch.ones((xi.shape[0], 1), device=x.device, requires_grad=True)
+            loss = Net.loss_PINN(xi, yi, w)
+            score.append( torch.autograd.grad(loss, w)[0].detach()[:,0]*xi.shape[0] )
+        return torch.cat(score).cpu().numpy()
+
+    def Update(self, Net, trainset, Weight):
+        """new training points (inputs, outputs, weight) on the device of
+           trainset, Weight(inputs) gives the weights of new points
+        """
+        n = trainset[0].shape[0]
+        inputs, outputs = self.sampler(self.pool or 10*n)
+        x = torch.tensor(inputs ).float().to(trainset[0].device)
+        y = torch.tensor(outputs).float().to(trainset[0].device)
+        score = self.Score(Net, x, y)
+        if self.mode == 'RAR':
+            ind = np.argsort(-score)[:self.nadd or max(n//10, 1)]
+            w = torch.tensor(Weight(inputs[ind])).float().to(x.device)
+            return tuple(torch.cat((t, s)) for t, s in zip(trainset, (x[ind], y[ind], w)))
+        p = score**self.k
+        p = p/p.mean() + self.c
+        # with fewer candidates of nonzero probability than n (a small pool,
+        # c = 0) the points are drawn with replacement
+        ind = np.random.choice(x.shape[0], n, replace=np.count_nonzero(p) < n, p=p/p.sum())
+        w = torch.tensor(Weight(inputs[ind])).float().to(x.device)
+        return (x[ind], y[ind], w)
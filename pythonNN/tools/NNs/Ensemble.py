@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+@Ensemble training
+Trains K POD_Nets of the same layers in lockstep. The weights of the nets are
+stacked into batched tensors (StackedMLP), so one step evaluates all K MLPs
+with one baddbmm per layer and the reduced residual of the K*n outputs at
+once, instead of K small passes. The loss of a step is the sum of the K losses,
+so every net gets exactly its own gradient, and Adam, acting elementwise, on
+the stacked weights equals K independent ones.
+All nets share the reduced operators and normalization of Nets[0], i.e. they
+must be built from the same roeqs (seed ensembles, NetSize sweeps, ...), and
+their activations must not have parameters (no adaptive_* activations).
+    data : one data tuple of train() shared by all nets, or a list of K
+           data tuples of equal sizes (one per net)
+The best weights of every net by its test loss are written to its own
+netfile with POD_Net.savenet, so loadnet reads them as usual.
+"""
+import copy
+import numpy as np
+import torch
+import torch.nn as nn
+from NN import DEVICE, train_options_default, Batcher, DistanceWeight
+
+
+class StackedMLP(nn.Module):
+    """The unets of K nets with stacked weights (K, in, out) and biases (K, 1, out)
+       forward maps (K*n, in) -> (K*n, out), the rows k*n:(k+1)*n belonging to
+       the net k; with select = k only the net k is evaluated, (n, in) -> (n, out)
+    """
+    def __init__(self, Nets):
+        super(StackedMLP, self).__init__()
+        self.K = len(Nets)
+        self.select  = None
+        self.weights = nn.ParameterList()
+        self.biases  = nn.ParameterList()
+        self.activations = []
+        units = [list(Net.unet) for Net in Nets]
+        for layer, *others in zip(*units):
+            if isinstance(layer, nn.Linear):
+                W = torch.stack([layer.weight.detach().T] + [other.weight.detach().T for other in others])
+                b = torch.stack([layer.bias.detach()[None,:]] + [other.bias.detach()[None,:] for other in others])
+                self.weights.append(nn.Parameter(W.clone()))
+                self.biases.append( nn.Parameter(b.clone()))
+                self.activations.append(None)
+            else:
+                if any(True for _ in layer.parameters()):
+                    raise Exception('Stacked nets do not support activations with parameters: ' + type(layer).__name__)
+                self.activations[-1] = layer
+
+    def forward(self, x):
+        K, W, b = self.K, list(self.weights), list(self.biases)
+        if self.select is not None:
+            K, W, b = 1, [w[self.select:self.select+1] for w in W], [c[self.select:self.select+1] for c in b]
+        x = x.reshape((K, -1, x.shape[-1]))
+        for Wi, bi, activate in zip(W, b, self.activations):
+            x = torch.baddbmm(bi, x, Wi)
+            if activate is not None:
+                x = activate(x)
+        return x.reshape((-1, x.shape[-1]))
+
+    def state_dict_of(self, k, Net):
+        # the state_dict of the unet of the net k, with the keys of Net
+        state_dict = Net.unet.state_dict()
+        names = [name for name, module in Net.unet.named_children() if isinstance(module, nn.Linear)]
+        for name, W, b in zip(names, self.weights, self.biases):
+            state_dict[name+'.weight'] = W[k].detach().T.clone()
+            state_dict[name+'.bias'  ] = b[k,0].detach().clone()
+        return state_dict
+
+def PrepareData(Net, data, options):
+    # tensors (inputs, outputs, weight[, labeled_inputs, labeled_outputs]) of one data tuple
+    if len(data) == 4:
+        inputs, outputs, datatype, trainratio = data
+        labeled = ()
+    elif len(data) == 6:
+        labeled_inputs, labeled_outputs, inputs, outputs, datatype, trainratio = data
+        labeled = (labeled_inputs, labeled_outputs)
+    else:
+        raise Exception('Expect inout <data> with 4 or 6 elements, but got %d'%len(data))
+    weight = np.ones((inputs.shape[0], 1))
+    if len(data) == 6:
+        weight = DistanceWeight(inputs, labeled_inputs, Net.roeqs.design_space, \
+                                options.get('weight_fun', lambda d: d), options.get('weight_chunk', 100000))
+    tensors = [torch.tensor(a).float().to(DEVICE) for a in (inputs, outputs, weight) + labeled]
+    return tensors, datatype, trainratio
+
+def train_ensemble(Nets, data, netfiles, options=train_options_default):
+    K = len(Nets)
+    shared = not isinstance(data, list)
+    datas  = [data] if shared else data
+    if not shared and len(datas) != K:
+        raise Exception('Expect %d data tuples, but got %d'%(K, len(datas)))
+    prepared = [PrepareData(Nets[0], d, options) for d in datas]
+    datatype, trainratio = prepared[0][1:]
+    # per-net data are stacked along dim 1, so that one permutation of the
+    # samples batches all nets
+    if shared:
+        tensors = prepared[0][0]
+    else:
+        tensors = [torch.stack(ts, dim=1) for ts in zip(*(p[0] for p in prepared))]
+    def Flatten(t, k=None):
+        # (n,[K,]...) -> (K*n,...) in the row order of StackedMLP, or the data of the net k
+        if k is not None:
+            return t if shared else t[:,k]
+        t = t[None].expand((K,) + t.shape) if shared else t.transpose(0, 1)
+        return t.reshape((-1,) + t.shape[2:])
+    n = tensors[0].shape[0]
+    trainsize = int(n*trainratio)
+    testsize  = n - trainsize
+    perm = torch.randperm(n, device=tensors[0].device)
+    trainset = [t[perm[:trainsize]] for t in tensors[:3]]
+    testset  = [t[perm[trainsize:]] for t in tensors[:3]]
+    labeled  = tensors[3:]
+    trainloader = Batcher(trainset, batch_size= trainsize//options['NBATCH'], shuffle = True)
+    testloader  = Batcher(testset , batch_size= testsize                    , shuffle = True)
+
+    Net = copy.deepcopy(Nets[0])
+    Net.unet = StackedMLP(Nets)
+    def Netloss(x, y, w, xlabel=None, ylabel=None):
+        if datatype == 'Label':
+            return Net.loss_NN(x, y)
+        loss = Net.loss_PINN(x, y, w)
+        if datatype == 'Hybrid':
+            loss = loss + Net.loss_NN(xlabel, ylabel)
+        return loss
+
+    optimizer = torch.optim.Adam(Net.unet.parameters(), lr=options['LR'], weight_decay=options['weight_decay'])
+    scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lr_lambda=options['lamda'])
+
+    # train: the mean loss over the nets, test: the loss of every net
+    loss_history_train = np.zeros((options['EPOCH'], 1))
+    loss_history_test  = np.zeros((options['EPOCH'], K))
+    epoch_test  = options.get('epoch_test', 1)
+    epoch_print = options.get('epoch_print', 10)
+    # the starting weights until a test epoch improves on them, NaN never does
+    best_value  = np.full(K, np.inf)
+    best_state  = [Net.unet.state_dict_of(k, Nets[k]) for k in range(K)]
+    loss_test   = np.zeros(K)
+    for epoch in range(options['EPOCH']):
+        loss_train = 0
+        for batch in trainloader:
+            optimizer.zero_grad()
+            # the mean over the K*n rows is the mean of the K losses
+            loss = Netloss(*(Flatten(t) for t in batch + tuple(labeled)))*K
+            loss.backward()
+            optimizer.step()
+            loss_train += loss.item()/K
+        if epoch % epoch_test == 0 or epoch == options['EPOCH']-1:
+            loss_test = np.zeros(K)
+            with torch.no_grad():
+                for k in range(K):
+                    Net.unet.select = k
+                    for batch in testloader:
+                        loss_test[k] += Netloss(*(Flatten(t, k) for t in batch + tuple(labeled))).item()*batch[0].shape[0]
+                Net.unet.select = None
+            loss_test = loss_test/max(testsize, 1)
+            for k in np.where(~np.isnan(loss_test) & (loss_test < best_value))[0]:
+                best_value[k] = loss_test[k]
+                best_state[k] = Net.unet.state_dict_of(k, Nets[k])
+        loss_history_train[epoch,0] = loss_train/len(trainloader)
+        loss_history_test[ epoch]   = loss_test
+        if epoch % epoch_print == 0:
+            print("|epoch=%5d | %d nets, mean loss=(%11.7e,  %11.7e)"%(epoch, K, loss_history_train[epoch,0],\
+                                                                        loss_test.mean()))
+        scheduler.step()
+    # unstack into the nets and write their best weights
+    for k in range(K):
+        Nets[k].unet.load_state_dict(best_state[k])
+        Nets[k].savenet(netfiles[k])
+    return loss_history_train, loss_history_test
@@ -10,21 +10,68 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.autograd as ag
-import torch.utils.data as Data
+import time
+import os
+import copy
+import warnings
 from collections import OrderedDict
-from Activations_plus import Swish
+from scipy.spatial import cKDTree
+from Checkpoint import AtomicSave, CheckpointWriter, RNGState, SetRNGState
+from Profiler import TrainProfiler
+from Runtime import Configure
+from Parallel import DataParallel
+from Activations_plus import Swish, Activation, ACTIVATIONS
 
+RUNTIME      = Configure()   # threads and affinity, see Runtime
 ACTIVATE     = Swish
 torch.manual_seed(12)  # reproducible
 np.random.seed(1234)
-DEVICE     = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+# POD_DEVICE selects the device, e.g. of the workers of a sweep, see Scheduler
+DEVICE     = torch.device(os.environ.get('POD_DEVICE') or ('cuda:0' if torch.cuda.is_available() else 'cpu'))
 train_options_default ={'EPOCH':3000,\
                         'LR':0.01, \
                         'lamda': lambda epoch: 0.95**(epoch//200),\
                         'epoch_print': 1,\
+                        'epoch_test': 1,\
                         'epoch_save':1000,
+                        'async_save': True,\
+                        'resume': False,\
+                        'profile': False,\
+                        'profile_trace': None,\
+                        'weight_fun': lambda d: d,\
+                        'weight_chunk': 100000,\
+                        'compile': False,\
+                        'autocast': None,\
+                        'resample': None,\
+                        'patience': 0,\
+                        'min_delta': 0,\
+                        'stop_start': 1000,\
+                        'metric': None,\
+                        'target_loss': None,\
+                        'LBFGS_EPOCH': 0,\
+                        'LBFGS': {'lr':1, 'max_iter':20, 'history_size':50, 'line_search_fn':'strong_wolfe'},\
                         }
 
+def CPUBFloat16():
+    # whether the CPU runs bfloat16 natively; torch has no public check, the
+    # private one may be gone in other torch versions, then float32 is kept
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError) as e:
+        warnings.warn('cannot check the bfloat16 support of the CPU (%s), train in float32'%e)
+        return False
+
+# output normalization of the nets, saved with the weights
+NORMALIZATION = ('proj_mean', 'proj_std')
+
+def Architecture(layers):
+    # the widths and the activation name of layers, the name of ACTIVATE if
+    # layers ends with none, so that equal nets compare equal either way
+    if isinstance(layers[-1], str):
+        return list(layers[:-1]), layers[-1]
+    names = [name for name, activation in ACTIVATIONS.items() if activation is ACTIVATE]
+    return list(layers), names[0] if names else ACTIVATE.__name__
+
 class POD_Net(nn.Module):
     def __init__(self, layers=None,OldNetfile=None):
         super(POD_Net, self).__init__()
@@ -37,6 +84,11 @@ class POD_Net(nn.Module):
             oldnet = torch.load(OldNetfile, map_location=lambda storage, loc: storage)
             layers = oldnet['layers']
         self.layers = layers
+        # layers may end with the name of the activation, see Activations_plus
+        activate = ACTIVATE
+        if isinstance(layers[-1], str):
+            name, layers = layers[-1], layers[:-1]
+            activate = lambda: Activation(name)
         for i in range(len(layers)-1):
             key    = "Layer%d_Linear"%i
             Value  = nn.Linear(layers[i],layers[i+1])
@@ -44,9 +96,37 @@ class POD_Net(nn.Module):
         
             if i != len(layers)-2:
                 key    = "Layer%d_avtivate"%i
-                Value  = ACTIVATE()
+                Value  = activate()
                 NetDict[key] = Value
         self.unet = nn.Sequential(NetDict)
+        self.autocast = None
+        self.profiler = None
+        
+    def MixedPrecision(self, dtype=torch.bfloat16):
+        """Run the MLP under autocast with dtype (None: float32)
+           Only unet is autocast, mlp returns float32 so that the operators and
+           the residual of the losses stay in float32. bfloat16 keeps the
+           exponent range of float32, so the losses need no scaling.
+        """
+        if dtype == torch.bfloat16 and DEVICE.type == 'cpu' and not CPUBFloat16():
+            print('bfloat16 is not supported by this CPU, train in float32')
+            dtype = None
+        self.autocast = dtype
+        return self
+    
+    def mlp(self, x):
+        if self.profiler is not None and not torch.compiler.is_compiling():
+            # the MLP is the 'forward' phase of the profile of train
+            with self.profiler.phase('forward'):
+                return self._mlp(x)
+        return self._mlp(x)
+    
+    def _mlp(self, x):
+        if self.autocast is None:
+            return self.unet(x)
+        with torch.autocast(device_type=x.device.type, dtype=self.autocast):
+            out = self.unet(x)
+        return out.float()
         
     def grad(self,a,b):
         if b.grad is not None:
@@ -69,14 +149,144 @@ class POD_Net(nn.Module):
     def loss_PINN(self, x, f):
         pass
     
+    def Compile(self):
+        """Opt-in compiled training path
+           loss_NN and loss_PINN, i.e. the normalization, the MLP and the reduced
+           residual of CustomedNet, are traced by torch.compile into one graph
+           each. Without torch.compile, or when compiling fails on the first
+           call, they run eagerly.
+        """
+        if not hasattr(torch, 'compile'):
+            print('torch.compile is not available, train eagerly')
+            return self
+        for name in ('loss_NN', 'loss_PINN'):
+            setattr(self, name, self._compiled(getattr(self, name)))
+        return self
+    
+    @staticmethod
+    def _compiled(fun):
+        # only the first call, which compiles, falls back to fun on an error;
+        # errors of later calls are errors of the model and are raised
+        compiled = [torch.compile(fun, dynamic=True), True]
+        def call(*args):
+            if not compiled[1]:
+                return compiled[0](*args)
+            compiled[1] = False
+            try:
+                return compiled[0](*args)
+            except Exception as e:
+                print('torch.compile failed (%s), %s runs eagerly'%(type(e).__name__, fun.__name__))
+                compiled[0] = fun
+                return fun(*args)
+        return call
+    
     def loadnet(self, OldNetfile):
         #self.load_state_dict(torch.load(OldNetfile)['state_dict'],  map_location=lambda storage, loc: storage) 
         state_dict = torch.load(OldNetfile, map_location=lambda storage, loc: storage)['state_dict']
         self.load_state_dict(state_dict) 
-    def savenet(self, netfile):
-        torch.save({'layers': self.layers, 'state_dict': self.state_dict()}, netfile )
+    def warmstart(self, OldNetfile):
+        """Start from a trained net of the same layers, e.g. the Label net of
+           the case: its weights and its output normalization proj_mean and
+           proj_std, so that the net starts from the predictions of the old one
+        """
+        checkpoint = torch.load(OldNetfile, map_location=lambda storage, loc: storage)
+        if Architecture(checkpoint['layers']) != Architecture(self.layers):
+            raise Exception('Cannot warm start %s from %s'%(str(self.layers), str(checkpoint['layers'])))
+        self.load_state_dict(checkpoint['state_dict'])
+        for name, value in checkpoint.get('normalization', {}).items():
+            setattr(self, name, value.to(getattr(self, name).device))
+    def grow(self, OldNetfile, scale=1E-2):
+        """Start from a trained net with fewer outputs and the same hidden layers,
+           e.g. of the first M of the M' POD modes of this net: the hidden
+           layers, the first M rows of the output layer and of the output
+           normalization are copied; the new rows keep their random weights
+           scaled by scale and get a zero bias, so they start near the mean of
+           their coefficients
+        """
+        checkpoint = torch.load(OldNetfile, map_location=lambda storage, loc: storage)
+        (old, oldname), (new, newname) = Architecture(checkpoint['layers']), Architecture(self.layers)
+        if oldname != newname or old[:-1] != new[:-1] or old[-1] > new[-1]:
+            raise Exception('Cannot grow %s from %s'%(str(self.layers), str(checkpoint['layers'])))
+        M = old[-1]
+        output = 'unet.Layer%d_Linear.'%(len(new)-2)
+        state_dict = self.state_dict()
+        for key, value in checkpoint['state_dict'].items():
+            if key.startswith(output):
+                grown = state_dict[key].clone()
+                grown[M:] = grown[M:]*scale if key.endswith('weight') else 0
+                grown[:M] = value
+                value = grown
+            state_dict[key] = value
+        self.load_state_dict(state_dict)
+        for name, value in checkpoint.get('normalization', {}).items():
+            grown = getattr(self, name).clone()
+            grown[..., :M] = value[..., :M].to(grown.device)
+            setattr(self, name, grown)
+    def savenet(self, netfile, state_dict=None, writer=None):
+        # atomic write, on the background thread of writer if given
+        checkpoint = {'layers': self.layers, 'state_dict': state_dict or self.state_dict(),\
+                      'normalization': {name: getattr(self, name) for name in NORMALIZATION if hasattr(self, name)}}
+        if writer:
+            writer.save(netfile, checkpoint)
+        else:
+            AtomicSave(checkpoint, netfile)
         
+
+def Finished(netfile):
+    # netfile holds a trained net: it exists and its training state, if any, is finished
+    if not os.path.isfile(netfile):
+        return False
+    if not os.path.isfile(netfile + '.state'):
+        return True
+    return torch.load(netfile + '.state', map_location='cpu', weights_only=False)['finished']
+
+class Batcher():
+    """Mini-batches of tensors already on the device
+       A shuffled epoch is one randperm on the device and the batches are
+       contiguous slices of the permuted tensors, the same batches as
+       DataLoader(TensorDataset(*tensors), batch_size, shuffle) without the
+       per-sample collation.
+    """
+    def __init__(self, tensors, batch_size, shuffle=True):
+        self.tensors    = tensors
+        self.n          = tensors[0].shape[0]
+        self.batch_size = max(batch_size, 1)
+        self.shuffle    = shuffle
+    def __len__(self):
+        return (self.n + self.batch_size - 1)//self.batch_size
+    def __iter__(self):
+        tensors = self.tensors
+        if self.shuffle:
+            perm = torch.randperm(self.n, device=tensors[0].device)
+            tensors = [t[perm] for t in tensors]
+        for i in range(0, self.n, self.batch_size):
+            yield tuple(t[i:i+self.batch_size] for t in tensors)
+
+def random_split(tensors, trainsize):
+    # random train/test split of the rows, as Data.random_split
+    perm = torch.randperm(tensors[0].shape[0], device=tensors[0].device)
+    return [t[perm[:trainsize]] for t in tensors], [t[perm[trainsize:]] for t in tensors]
     
+def NearestDistance(inputs, labeled_inputs, design_space, chunk=100000):
+    # distance to the nearest labeled input in the design space scaled to the
+    # unit box, from a KD-tree of the labeled inputs queried chunk points at a time
+    scale = design_space[1:2,:] - design_space[0:1,:]
+    tree  = cKDTree(labeled_inputs/scale)
+    dis   = np.zeros((inputs.shape[0], 1))
+    for i in range(0, inputs.shape[0], chunk):
+        dis[i:i+chunk,0], _ = tree.query(inputs[i:i+chunk,:]/scale)
+    return dis
+
+def DistanceWeight(inputs, labeled_inputs, design_space, fun=lambda d: d, chunk=100000, dmax=None, dis=None):
+    """Weights of the residual points of the Hybrid data
+       d = NearestDistance normalized by dmax, its maximum over inputs by
+       default; the weight is fun(d), linear by default. dis are the
+       distances if already known.
+    """
+    if dis is None:
+        dis = NearestDistance(inputs, labeled_inputs, design_space, chunk)
+    return fun(dis/(dmax or dis.max()))
+
 def train(Net,data, netfile, options=train_options_default):
     if len(data) == 4:
         inputs, outputs, datatype, trainratio = data
@@ -85,24 +295,34 @@ def train(Net,data, netfile, options=train_options_default):
     else:
         raise Exception('Expect inout <data> with 4 or 6 elements, but got %d'%len(data))
 
-    weight = np.ones((inputs.shape[0], 1))
+    Weight = lambda x: np.ones((x.shape[0], 1))
+    weight = Weight(inputs)
     if len(data) ==6:
-        lb = Net.roeqs.design_space[0:1,:]; ub=Net.roeqs.design_space[1:2,:]
-        dis = np.zeros((inputs.shape[0], 1))
-        for i in range(inputs.shape[0]):
-            diff = ( inputs[i:i+1,:]-labeled_inputs )/(ub-lb)
-            dis[i,0] = np.linalg.norm(diff, axis=1).min()
-        weight = dis/dis.max()
+        # one KD-tree query for the initial points, dmax normalizes the
+        # weights of the points added by resampling as well
+        labeled_array = labeled_inputs
+        dis    = NearestDistance(inputs, labeled_array, Net.roeqs.design_space, options.get('weight_chunk', 100000))
+        dmax   = dis.max()
+        Weight = lambda x, dis=None: DistanceWeight(x, labeled_array, Net.roeqs.design_space, options.get('weight_fun', lambda d: d),\
+                                                    options.get('weight_chunk', 100000), dmax, dis)
+        weight = Weight(inputs, dis)
         
-    dataset   = Data.TensorDataset(torch.tensor(inputs).float().to(DEVICE),\
-                                   torch.tensor(outputs).float().to(DEVICE),\
-                                   torch.tensor(weight).float().to(DEVICE),\
-                                   )
+    dataset   = (torch.tensor(inputs).float().to(DEVICE),\
+                 torch.tensor(outputs).float().to(DEVICE),\
+                 torch.tensor(weight).float().to(DEVICE),\
+                 )
     trainsize =  int(inputs.shape[0] * trainratio)
     testsize  =  inputs.shape[0] - trainsize
-    trainset, testset = Data.random_split(dataset, [trainsize, testsize])
-    trainloader = Data.DataLoader(trainset, batch_size= trainsize//options['NBATCH'], shuffle = True)
-    testloader  = Data.DataLoader(testset , batch_size= testsize                    , shuffle = True) 
+    trainset, testset = random_split(dataset, trainsize)
+    # data parallel under torchrun: the points of rank 0 sharded over the
+    # ranks, the weights of rank 0 on all of them, see Parallel
+    parallel  = DataParallel()
+    parallel.broadcast(trainset + testset + list(Net.state_dict().values()))
+    trainset, testset = parallel.shard(trainset), parallel.shard(testset)
+    trainsize, testsize = trainset[0].shape[0], testset[0].shape[0]
+    parallel.diverge()
+    trainloader = Batcher(trainset, batch_size= trainsize//options['NBATCH'], shuffle = True)
+    testloader  = Batcher(testset , batch_size= testsize                    , shuffle = True) 
     
     
     def lossHybrid(xresi,yresi,weight):
@@ -122,44 +342,209 @@ def train(Net,data, netfile, options=train_options_default):
     else:
         raise Exception('wrong datatpe in data:' + datatype)
         
-    def closure():
-        optimizer.zero_grad()
-        loss = Netloss(batch_in, batch_out, weight)
-        loss.backward()
-        return loss  
+    def Closure(batch_in, batch_out, weight):
+        def closure():
+            optimizer.zero_grad()
+            with profiler.phase('loss'):
+                loss = Netloss(batch_in, batch_out, weight)
+            with profiler.phase('backward'):
+                loss.backward()
+            return parallel.average(loss, Net.parameters())
+        return closure
+    
+    if options.get('compile', False):
+        Net.Compile()
+    # autocast during train only, restored on return
+    autocast = Net.autocast
+    if options.get('autocast', None):
+        Net.MixedPrecision(options['autocast'])
+    
+    def Evaluate(loader, autocast):
+        # mean loss over the cases of loader, with the MLP autocast or not
+        autocast, Net.autocast = Net.autocast, autocast
+        loss = 0
+        with torch.no_grad():
+            for x, y, w in loader:
+                loss += Netloss(x, y, w).item()*x.shape[0]
+        Net.autocast = autocast
+        loss, n = parallel.sum(loss, loader.n)
+        return loss/max(n, 1)
+    
+    # residual-based adaptive collocation, see Collocation.Resampler
+    resampler = options.get('resample', None) if datatype != 'Label' else None
+    
+    # optimizer schedule: EPOCH epochs of Adam with mini-batches, then
+    # LBFGS_EPOCH epochs of full-batch L-BFGS (one optimizer step per epoch)
+    NAdam  = options['EPOCH']
+    NEPOCH = NAdam + options.get('LBFGS_EPOCH', 0)
+    loss_history_train = np.zeros((NEPOCH, 1))
+    loss_history_test  = np.zeros((NEPOCH, 1))
+    # the test split is evaluated every epoch_test epochs, the epochs between
+    # keep the last evaluated value
+    epoch_test  = options.get('epoch_test', 1)
+    epoch_print = options.get('epoch_print', 1)
+    
+    # early stopping: the test loss, or metric(Net) if given (e.g. GetError on
+    # validation cases), is checked at the test epochs; from epoch stop_start
+    # on, training stops when it has not improved by min_delta for patience
+    # epochs, 0: never (counted from the start of the L-BFGS stage in it; a plateau of
+    # Adam starts the L-BFGS stage early instead of stopping when LBFGS_EPOCH
+    # > 0). netfile always receives the best weights, the starting weights
+    # if no test epoch improves on them; a NaN value (diverged) never improves.
+    metric   = options.get('metric', None)
+    patience = options.get('patience', None)
+    best     = {'value': np.inf, 'epoch': 0, 'state_dict': copy.deepcopy(Net.state_dict())}
+    writer   = CheckpointWriter() if options.get('async_save', True) and parallel.rank == 0 else None
+    def SaveBest():
+        if parallel.rank == 0:
+            Net.savenet(netfile, best['state_dict'], writer)
     
-    loss_history_train = np.zeros((options['EPOCH'], 1))
-    NBatch = len(trainloader)
-    loss_history_test  = np.zeros((options['EPOCH'], 1))
+    # time to target: the first test epoch with a test loss of at most
+    # target_loss and the training time until then, left in Net.target
+    target   = {'loss': options.get('target_loss', None), 'epoch': -1, 'time': np.nan}
+    
+    # opt-in per-phase timings and memory per epoch, see Profiler
+    scalars  = {key: value for key, value in options.items() if isinstance(value, (int, float, str, tuple))}
+    profiler = TrainProfiler(netfile + '.profile.jsonl' if options.get('profile', False) and parallel.rank == 0 else None,\
+                             options.get('profile_trace', None), netfile + '.trace.json',\
+                             {'netfile': netfile, 'datatype': datatype, 'layers': Net.layers, 'options': scalars})
     
     optimizer = torch.optim.Adam(Net.parameters(), lr=options['LR'], weight_decay=options['weight_decay'])
-    #optimizer = torch.optim.LBFGS(Net.parameters(), lr=options['LR'])
     #lamda1 = lambda epoch: 0.95**(epoch//50)
     scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lr_lambda=options['lamda'])
 
-    for epoch in range(options['EPOCH']):
-        loss_train = 0; loss_test =0
-        for nbatch, (batch_in, batch_out, weight) in enumerate(trainloader):      
-            running_loss=optimizer.step(closure)
-            loss_train += running_loss 
-            with torch.no_grad():
-                for nbatch2, (x_test, y_test, weight) in enumerate(testloader):  
-                    loss_test   += Netloss(x_test, y_test, weight) 
-            if epoch%options['epoch_print'] == 0:
-                print("|epoch=%5d,nbatch=%5d | loss=(%11.7e,  %11.7e)"%(epoch,nbatch,running_loss,loss_test)) 
-        loss_history_train[epoch,0] = loss_train/NBatch
-        loss_history_test[ epoch,0] = loss_test/NBatch  
+    # resume: netfile.state holds the complete training state, written with
+    # the best weights; train continues from it where the last run stopped
+    statefile = netfile + '.state'
+    def SaveState(epoch, finished=False):
+        # collective under torchrun: the shards are gathered on rank 0
+        sets = parallel.gather(list(trainset) + list(testset))
+        rngs = parallel.gather_object(RNGState())
+        if parallel.rank > 0:
+            return
+        state = {'epoch': epoch, 'finished': finished, 'state_dict': Net.state_dict(),\
+                 'lbfgs': isinstance(optimizer, torch.optim.LBFGS), 'optimizer': optimizer.state_dict(),\
+                 'scheduler': scheduler.state_dict(), 'rng': rngs[0], 'rng_ranks': rngs,\
+                 'trainset': sets[:3], 'testset': sets[3:], 'best': best, 'loss_test': loss_test, 'gap': gap,\
+                 'target': target, 'switch': NAdam, 'elapsed': time.perf_counter() - tstart,\
+                 'loss_history_train': loss_history_train[:epoch], 'loss_history_test': loss_history_test[:epoch]}
+        if writer:
+            writer.save(statefile, state)
+        else:
+            AtomicSave(state, statefile)
+    
+    loss_test = 0; nsample = 0; time_train = 0; gap = 0; start = 0; tstart = time.perf_counter()
+    if options.get('resume', False) and os.path.isfile(statefile):
+        state = torch.load(statefile, map_location=DEVICE, weights_only=False)
+        Net.load_state_dict(state['state_dict'])
+        trainset, testset = parallel.shard(state['trainset']), parallel.shard(state['testset'])
+        trainsize, testsize = trainset[0].shape[0], testset[0].shape[0]
+        testloader = Batcher(testset, batch_size= testsize, shuffle = True)
+        if state['lbfgs']:
+            optimizer = torch.optim.LBFGS(Net.parameters(), **options['LBFGS'])
+            trainloader = Batcher(trainset, batch_size= trainsize, shuffle = False)
+        else:
+            trainloader = Batcher(trainset, batch_size= trainsize//options['NBATCH'], shuffle = True)
+        optimizer.load_state_dict(state['optimizer'])
+        scheduler.load_state_dict(state['scheduler'])
+        start = state['epoch']
+        NAdam = state.get('switch', NAdam)
+        NEPOCH = NAdam + options.get('LBFGS_EPOCH', 0)
+        loss_history_train[:start] = state['loss_history_train']
+        loss_history_test[ :start] = state['loss_history_test']
+        best, loss_test, gap = state['best'], state['loss_test'], state['gap']
+        target, tstart = state['target'], time.perf_counter() - state['elapsed']
+        if len(state['rng_ranks']) == parallel.world:
+            SetRNGState(state['rng_ranks'][parallel.rank])
+        else:
+            SetRNGState(state['rng'])
+            parallel.diverge()
+        parallel.log('|resume %s from epoch %d'%(netfile, start))
+        if state['finished']:
+            start = NEPOCH
+    Net.profiler = profiler if profiler.enabled else None
+    profiler.start(start)
+    error = None
+    try:
+        for epoch in range(start, NEPOCH):
+            if epoch == NAdam:
+                parallel.log('|switch to full-batch L-BFGS at epoch %d'%epoch)
+                optimizer = torch.optim.LBFGS(Net.parameters(), **options['LBFGS'])
+                trainloader = Batcher(trainset, batch_size= trainsize, shuffle = False)
+            if resampler is not None and epoch > 0 and epoch % resampler.epoch == 0:
+                with profiler.phase('resample'):
+                    trainset  = resampler.Update(Net, trainset, Weight)
+                trainsize = trainset[0].shape[0]
+                trainloader = Batcher(trainset, batch_size= trainsize if epoch >= NAdam else trainsize//options['NBATCH'],\
+                                      shuffle = epoch < NAdam)
+            loss_train = 0
+            tic = time.perf_counter()
+            for batch_in, batch_out, weight in profiler.iterate(trainloader):      
+                with profiler.phase('step'):
+                    running_loss=optimizer.step(Closure(batch_in, batch_out, weight))
+                loss_train += running_loss.item()
+            time_train += time.perf_counter() - tic
+            nsample    += trainsize*parallel.world
+            if epoch % epoch_test == 0 or epoch == NEPOCH-1:
+                # the test loss is always float32, with autocast also compared
+                # against the mixed-precision loss at the print epochs
+                with profiler.phase('test'):
+                    loss_test = Evaluate(testloader, None)
+                    if Net.autocast is not None and epoch % epoch_print == 0:
+                        gap = abs(Evaluate(testloader, Net.autocast)-loss_test)/max(loss_test, 1E-30)
+                    value = metric(Net) if metric else loss_test
+                if not np.isnan(value) and value < best['value'] - options.get('min_delta', 0):
+                    best.update(value=value, epoch=epoch, state_dict=copy.deepcopy(Net.state_dict()))
+                if target['loss'] is not None and target['epoch'] < 0 and loss_test <= target['loss']:
+                    target.update(epoch=epoch, time=time.perf_counter() - tstart)
+                    parallel.log('|reached the target loss %.3e at epoch %d after %.1fs'%(target['loss'], epoch, target['time']))
+            loss_history_train[epoch,0] = loss_train/len(trainloader)
+            loss_history_test[ epoch,0] = loss_test
+            if epoch % epoch_print == 0:
+                parallel.log("|epoch=%5d | loss=(%11.7e,  %11.7e) | %9.1f samples/s"%(epoch,loss_history_train[epoch,0],\
+                                                                                    loss_test,nsample/time_train))
+                if Net.autocast is not None:
+                    parallel.log("|            | relative gap of the %s test loss to float32 %.2e"%(str(Net.autocast), gap))
+                nsample = 0; time_train = 0
         
-        if epoch>=1000 and datatype == 'Label':
-            if np.all( loss_history_test[epoch-5:epoch+1,0]>loss_history_test[epoch-6:epoch,0]):
-                Net.savenet(netfile)
-                return loss_history_train, loss_history_test
-        scheduler.step()
-        if epoch % options['epoch_save'] == 0 or epoch == options['EPOCH']-1:
-            Net.savenet(netfile)
+            stop = patience and epoch >= options.get('stop_start', 0) and \
+                   epoch - max(best['epoch'], NAdam if epoch >= NAdam else 0) >= patience
+            if stop and epoch < NAdam < NEPOCH:
+                parallel.log('|no improvement since epoch %d, end Adam at epoch %d'%(best['epoch'], epoch))
+                NAdam, NEPOCH, stop = epoch+1, epoch+1 + options.get('LBFGS_EPOCH', 0), False
+            if not stop:
+                if epoch < NAdam:
+                    scheduler.step()
+                if epoch % options['epoch_save'] == 0:
+                    with profiler.phase('checkpoint'):
+                        SaveBest()
+                        SaveState(epoch+1)
+            profiler.epoch(epoch, trainsize, (Net, optimizer.state, trainset, testset), loss_train=\
+                           loss_history_train[epoch,0], loss_test=loss_test, lr=optimizer.param_groups[0]['lr'])
+            if stop:
+                parallel.log('|stop at epoch %d, no improvement since epoch %d (%11.7e)'%(epoch, best['epoch'], best['value']))
+                break
+            if epoch == NEPOCH-1:
+                # the L-BFGS stage started early and is done
+                break
+        SaveState(epoch+1 if start < NEPOCH else start, finished=True)
+        Net.load_state_dict(best['state_dict'])
+        SaveBest()
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        profiler.close()
+        Net.profiler = None
+        Net.target   = target
+        Net.autocast = autocast
+        if writer:
+            try:
+                writer.close()
+            except Exception as e:
+                if error is None:
+                    raise
+                # the error of the training is raised, not the failed write
+                parallel.log('|writing a checkpoint failed as well: %s: %s'%(type(e).__name__, e))
+    parallel.barrier()
     return loss_history_train, loss_history_test
-    
-     
-
-
-
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+@Data-parallel training
+train() runs data parallel over the processes started by torchrun, e.g.
+    torchrun --standalone --nproc_per_node=4 Cases_test.py
+or over several nodes with --nnodes and --rdzv_endpoint. The processes form a
+gloo process group (CPU):
+    - the training and test points of rank 0 are broadcast and split into
+      equal contiguous shards, one per rank (the remainder rows of the
+      division are dropped); the labeled data of the Hybrid loss are
+      replicated on every rank
+    - the gradients and the loss are averaged over the ranks after every
+      backward pass, so the Adam and L-BFGS steps are identical on all ranks
+      and the global batch equals the batch of a single process
+    - test losses are averaged over the shards, so early stopping agrees
+    - only rank 0 writes the net, its state and the profile and prints
+Without torchrun (WORLD_SIZE unset or 1) every method is a no-op.
+"""
+import os
+import atexit
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+def Rank():
+    # rank of this process, 0 without torchrun
+    return int(os.environ.get('RANK', 0))
+
+def Init():
+    if not dist.is_available() or int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        return 0, 1
+    if not dist.is_initialized():
+        dist.init_process_group('gloo')
+        atexit.register(dist.destroy_process_group)
+    return dist.get_rank(), dist.get_world_size()
+
+
+class DataParallel():
+    def __init__(self):
+        self.rank, self.world = Init()
+        self.active = self.world > 1
+
+    def log(self, *args):
+        if self.rank == 0:
+            print(*args)
+
+    def broadcast(self, tensors):
+        # tensors of rank 0 on all ranks, in place
+        if self.active:
+            for t in tensors:
+                dist.broadcast(t.data, 0)
+        return tensors
+
+    def shard(self, tensors):
+        if not self.active:
+            return tensors
+        n = tensors[0].shape[0]//self.world
+        return [t[self.rank*n:(self.rank+1)*n] for t in tensors]
+
+    def gather(self, tensors):
+        # the shards of all ranks joined, in the order of the ranks
+        if not self.active:
+            return tensors
+        gathered = []
+        for t in tensors:
+            parts = [torch.empty_like(t) for i in range(self.world)]
+            dist.all_gather(parts, t.contiguous())
+            gathered.append(torch.cat(parts))
+        return gathered
+
+    def gather_object(self, obj):
+        # the objects of all ranks on every rank, [obj] without torchrun
+        if not self.active:
+            return [obj]
+        objs = [None]*self.world
+        dist.all_gather_object(objs, obj)
+        return objs
+
+    def diverge(self):
+        # different random streams on the ranks from here on (batches, resampling)
+        if self.active:
+            torch.manual_seed(torch.randint(2**31, (1,)).item() + self.rank)
+            np.random.seed((np.random.randint(2**31) + self.rank) % 2**32)
+
+    def average(self, loss, parameters):
+        """averages the gradients of parameters and the loss over the ranks
+           with one all_reduce; returns the averaged loss, detached
+        """
+        if not self.active:
+            return loss
+        grads = [p.grad for p in parameters if p.grad is not None]
+        flat  = torch.cat([g.reshape(-1) for g in grads] + [loss.detach().reshape(1)])/self.world
+        dist.all_reduce(flat)
+        i = 0
+        for g in grads:
+            g.copy_(flat[i:i+g.numel()].reshape(g.shape))
+            i += g.numel()
+        return flat[-1]
+
+    def sum(self, *values):
+        if not self.active:
+            return values
+        t = torch.tensor(values, dtype=torch.float64)
+        dist.all_reduce(t)
+        return tuple(t.tolist())
+
+    def barrier(self):
+        if self.active:
+            dist.barrier()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+@Training profiler
+Opt-in instrumentation of train(), options['profile'] = True. Every epoch one
+JSON line is appended to netfile.profile.jsonl:
+    epoch, time     :: the epoch and its wall time in seconds
+    samples_per_s   :: training samples per second of the epoch
+    phases          :: exclusive seconds per phase; nested phases are joined
+                       by '/', e.g. step/loss/forward is the MLP inside the
+                       loss inside the optimizer step, so the phases add up
+                       to the time spent in them
+    calls           :: number of entries per phase (L-BFGS evaluates the
+                       loss several times per step)
+    rss_peak_mb     :: peak resident memory of the process
+    tensor_mb       :: the tensors of the net, optimizer and data on the CPU,
+                       or the peak allocated CUDA memory of the epoch
+and the values passed by train (losses, lr). The first line of a run records
+the code version (git commit), torch version, threads, cores (see Runtime)
+and scalar options, so runs of different code versions can be compared.
+With options['profile_trace'] = (start, stop), the epochs start..stop-1 are
+also recorded by torch.profiler, with the phases as labelled ranges, and
+written to netfile.trace.json (chrome://tracing, Perfetto).
+The timers synchronize CUDA on every phase boundary, which serializes the GPU;
+compare timings of profiled runs with each other only.
+"""
+import os
+import json
+import time
+import subprocess
+from contextlib import contextmanager
+import torch
+from Runtime import CONFIG
+try:
+    import resource
+except ImportError:     # Unix only
+    resource = None
+
+
+def CodeVersion():
+    # git commit of the code, with '+' if the tree has local changes
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd, capture_output=True, \
+                                text=True, timeout=10).stdout.strip()
+        dirty  = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd, \
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return (commit + ('+' if dirty else '')) or None
+
+def TensorBytes(*objs):
+    # bytes of the distinct storages of the tensors in objs (modules, dicts, lists)
+    seen = set()
+    def walk(obj):
+        if isinstance(obj, torch.nn.Module):
+            for t in list(obj.parameters()) + list(obj.buffers()):
+                walk(t)
+                walk(t.grad)
+        elif torch.is_tensor(obj):
+            storage = obj.untyped_storage()
+            seen.add((storage.data_ptr(), storage.nbytes()))
+        elif isinstance(obj, dict):
+            for value in obj.values():
+                walk(value)
+        elif isinstance(obj, (list, tuple)):
+            for value in obj:
+                walk(value)
+    for obj in objs:
+        walk(obj)
+    return sum(nbytes for _, nbytes in seen)
+
+
+class TrainProfiler():
+    def __init__(self, file=None, trace=None, tracefile=None, info=None):
+        """file: the JSON-lines file, None disables the profiler so that
+           phase() and epoch() cost next to nothing; trace: (start, stop)
+           epochs recorded by torch.profiler into tracefile; info: added to
+           the first line
+        """
+        self.file    = file
+        self.enabled = file is not None
+        self.trace   = trace if self.enabled else None
+        self.tracefile = tracefile
+        self.prof    = None
+        self.stack   = []       # names of the open phases
+        self.inner   = []       # seconds of the nested phases of each open phase
+        self.timers  = {}
+        self.calls   = {}
+        self.cuda    = torch.cuda.is_available()
+        self.tic     = time.perf_counter()
+        if not self.enabled:
+            return
+        self.out = open(file, 'a')
+        header = {'run': time.strftime('%Y-%m-%d %H:%M:%S'), 'code': CodeVersion(), 'torch': torch.__version__,\
+                  'threads': torch.get_num_threads(), 'cores': CONFIG.get('cores'),\
+                  'device': 'cuda' if self.cuda else 'cpu'}
+        header.update(info or {})
+        self.write(header)
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+    def write(self, record):
+        self.out.write(json.dumps(record, default=str) + '\n')
+        self.out.flush()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        if self.cuda:
+            torch.cuda.synchronize()
+        path = '/'.join(self.stack + [name])
+        self.stack.append(name)
+        label = torch.profiler.record_function(path) if self.prof else None
+        if label:
+            label.__enter__()
+        self.inner.append(0.0)
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.cuda:
+                torch.cuda.synchronize()
+            toc = time.perf_counter()
+            self.timers[path] = self.timers.get(path, 0.0) + toc - tic - self.inner.pop()
+            self.calls[path]  = self.calls.get(path, 0) + 1
+            if self.inner:
+                self.inner[-1] += toc - tic
+            if label:
+                label.__exit__(None, None, None)
+            self.stack.pop()
+
+    def iterate(self, loader, name='batch'):
+        # the batches of loader, the time to produce each one as phase name
+        iterator = iter(loader)
+        while True:
+            with self.phase(name):
+                batch = next(iterator, None)
+            if batch is None:
+                return
+            yield batch
+
+    def epoch(self, epoch, samples, tensors=(), **values):
+        """end of epoch: writes its record and starts the next one
+           samples: training samples of the epoch, tensors: the objects whose
+           tensors are counted on the CPU, values: added to the record
+        """
+        if not self.enabled:
+            return
+        if self.trace and epoch == self.trace[1]-1:
+            self._stop_trace()
+        toc = time.perf_counter()
+        record = {'epoch': epoch, 'time': toc - self.tic, 'samples_per_s': samples/max(toc - self.tic, 1E-12)}
+        record.update(values)
+        record['phases'] = self.timers
+        record['calls']  = self.calls
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            record['rss_peak_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+        if self.cuda:
+            record['tensor_mb'] = torch.cuda.max_memory_allocated()/2**20
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            record['tensor_mb'] = TensorBytes(*tensors)/2**20
+        self.write(record)
+        self.timers, self.calls = {}, {}
+        if self.trace and epoch+1 == self.trace[0]:
+            self._start_trace()
+        self.tic = time.perf_counter()
+
+    def start(self, epoch):
+        # start of training at epoch (0, or the epoch of a resumed run)
+        if self.trace and self.trace[0] <= epoch < self.trace[1]:
+            self._start_trace()
+        self.tic = time.perf_counter()
+
+    def _start_trace(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.prof = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self.prof.start()
+
+    def _stop_trace(self):
+        if self.prof is None:
+            return
+        self.prof.stop()
+        self.prof.export_chrome_trace(self.tracefile)
+        self.prof = None
+
+    def close(self):
+        if not self.enabled:
+            return
+        self._stop_trace()
+        self.out.close()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+@Runtime configuration
+Threads and CPU affinity of a training or sweep process, applied by NN at
+import, so that the problem modules and case scripts share it. Concurrent
+jobs on one node each get their own block of cores instead of all of them
+starting one thread per core for PyTorch and for BLAS.
+Set by environment variables (e.g. by the launcher of the jobs) or Configure:
+    POD_JOBS    :: number of concurrent jobs on the node, the cores available
+                   to the process are split into POD_JOBS contiguous blocks
+    POD_WORKER  :: index of this job, 0..POD_JOBS-1, it uses block POD_WORKER
+    POD_THREADS :: intra-op threads of PyTorch and BLAS threads, the size of
+                   the block by default
+    POD_INTEROP :: inter-op threads of PyTorch, 1 by default
+    POD_PIN     :: 1 pins the process to its block (Linux)
+The processes of torchrun (see Parallel) are the jobs of their node by
+default, POD_JOBS = LOCAL_WORLD_SIZE and POD_WORKER = LOCAL_RANK.
+Without any of them the defaults of PyTorch and BLAS are left unchanged.
+The BLAS threads of numpy/scipy are limited with threadpoolctl if it is
+installed; otherwise only OMP_NUM_THREADS etc. set before the start of the
+process take effect.
+"""
+import os
+import torch
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+VARIABLES = ('POD_JOBS', 'POD_WORKER', 'POD_THREADS', 'POD_INTEROP', 'POD_PIN')
+BLAS      = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+CONFIG    = {}
+
+def Cores():
+    # the cores this process may run on
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def Partition(cores, jobs, worker):
+    # block worker of cores split into jobs contiguous blocks, as even as
+    # possible; with more jobs than cores the blocks share cores
+    n = len(cores)
+    if jobs >= n:
+        return [cores[worker % n]]
+    start = worker*n//jobs
+    return cores[start:(worker+1)*n//jobs]
+
+def Configure(jobs=None, worker=None, threads=None, interop=None, pin=None):
+    """Applies the configuration once per process, arguments override the
+       environment variables; returns the configuration applied
+    """
+    if CONFIG:
+        return CONFIG
+    env = lambda name: int(os.environ[name]) if os.environ.get(name) else None
+    jobs    = jobs    if jobs    is not None else env('POD_JOBS')   or env('LOCAL_WORLD_SIZE')
+    worker  = worker  if worker  is not None else env('POD_WORKER') or env('LOCAL_RANK')
+    threads = threads if threads is not None else env('POD_THREADS')
+    interop = interop if interop is not None else env('POD_INTEROP')
+    pin     = pin     if pin     is not None else bool(env('POD_PIN'))
+    if jobs is None and threads is None and interop is None and not pin:
+        CONFIG.update(threads=torch.get_num_threads(), cores=None)
+        return CONFIG
+    cores   = Partition(Cores(), jobs or 1, worker or 0)
+    threads = threads or len(cores)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop or 1)
+    except RuntimeError:
+        # only possible before the first inter-op parallel work
+        pass
+    if threadpool_limits is not None:
+        threadpool_limits(limits=threads)
+    # inherited by the child processes
+    for name in BLAS:
+        os.environ[name] = str(threads)
+    if pin and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    CONFIG.update(threads=threads, interop=torch.get_num_interop_threads(), cores=cores, pinned=bool(pin),\
+                  blas='threadpoolctl' if threadpool_limits else 'environment')
+    return CONFIG
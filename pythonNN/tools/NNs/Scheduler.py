@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+@Sweep scheduler
+Sweep runs the jobs of a parameter sweep, e.g. the cases of gen_testcases, on
+a pool of worker processes of this node, instead of background scripts that
+patch the device into the sources:
+    - every worker is a new process (spawn) with its own device and block of
+      cores, given by the environment variables it starts with:
+          POD_DEVICE  :: torch device of NN.DEVICE, the cuda devices round
+                         robin, or cpu without cuda
+          POD_JOBS, POD_WORKER and the BLAS threads, see Runtime
+    - a job starts when the jobs it depends on are done; the jobs depending
+      on a failed job are skipped, the others go on
+    - the output of a job goes to logdir/<name>.out, the progress of the sweep
+      is printed as the jobs start and finish
+    - a worker that dies (e.g. killed) fails its job and is restarted
+run and the jobs must be picklable: functions and classes of modules or of
+the main script, which is imported again (not run) by every worker.
+"""
+import os
+import sys
+import time
+import queue
+import traceback
+import contextlib
+import multiprocessing as mp
+import torch
+from Runtime import Cores, Partition, BLAS
+
+
+def Devices():
+    # the cuda devices, or the cpu
+    n = torch.cuda.device_count() if torch.cuda.is_available() else 0
+    return ['cuda:%d'%i for i in range(n)] or ['cpu']
+
+def _worker(run, tasks, results, logdir, worker):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        name, job = task
+        tic = time.perf_counter()
+        log = open(os.path.join(logdir, name+'.out'), 'a') if logdir else None
+        try:
+            with contextlib.redirect_stdout(log or sys.stdout), contextlib.redirect_stderr(log or sys.stderr):
+                result = run(job)
+            ok = True
+        except Exception:
+            result, ok = traceback.format_exc(), False
+        finally:
+            if log:
+                log.close()
+        results.put((name, ok, result, time.perf_counter()-tic, worker))
+
+def Sweep(run, jobs, workers=1, devices=None, threads=None, logdir=None):
+    """Runs run(job) for the jobs [(name, job, deps), ...] on workers processes,
+       in the order of jobs as far as the dependencies allow; deps are the
+       names of the jobs to finish first, names not among the jobs are ignored.
+       devices: torch devices of the workers, round robin, Devices() by default
+       threads: threads of a worker, its block of the cores by default
+       returns {name: run(job)} of the jobs done, in the order of jobs, and
+       {name: traceback or reason} of the failed and skipped jobs
+    """
+    devices  = devices or Devices()
+    names    = [name for name, job, deps in jobs]
+    if len(set(names)) != len(names):
+        raise Exception('duplicate job names')
+    todo     = {name: job for name, job, deps in jobs}
+    needs    = {name: [d for d in deps if d in todo] for name, job, deps in jobs}
+    if logdir:
+        os.makedirs(logdir, exist_ok=True)
+    ctx      = mp.get_context('spawn')
+    results  = ctx.Queue()
+    tasks    = [ctx.Queue() for w in range(workers)]
+    procs    = [None]*workers
+
+    def start(w):
+        env = {'POD_JOBS': str(workers), 'POD_WORKER': str(w), 'POD_DEVICE': devices[w % len(devices)]}
+        n   = threads or len(Partition(Cores(), workers, w))
+        env.update({name: str(n) for name in BLAS}, POD_THREADS=str(n))
+        # the environment of the new process; restored for the next worker
+        saved = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+        try:
+            procs[w] = ctx.Process(target=_worker, args=(run, tasks[w], results, logdir, w), daemon=True)
+            procs[w].start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name)
+                else:
+                    os.environ[name] = value
+
+    def report(name, status, seconds, w):
+        print('[%d/%d] %-48s %s in %.1fs (worker %d, %s)'%(len(done)+len(failed), len(names),\
+              name, status, seconds, w, devices[w % len(devices)]), flush=True)
+
+    for w in range(workers):
+        start(w)
+    pending, running, done, failed = list(names), {}, {}, {}
+    idle  = list(range(workers))
+    print('sweep of %d jobs on %d workers (%s)'%(len(names), workers, ', '.join(sorted(set(devices[:workers])))), flush=True)
+    tic   = time.perf_counter()
+    try:
+        while pending or running:
+            skipped = [name for name in pending if any(d in failed for d in needs[name])]
+            for name in skipped:
+                pending.remove(name)
+                failed[name] = 'skipped: depends on ' + ', '.join(d for d in needs[name] if d in failed)
+                print('[%d/%d] %-48s skipped'%(len(done)+len(failed), len(names), name), flush=True)
+            if skipped:
+                continue
+            for name in [name for name in pending if all(d in done for d in needs[name])]:
+                if not idle:
+                    break
+                w = idle.pop(0)
+                pending.remove(name)
+                running[w] = (name, time.perf_counter())
+                tasks[w].put((name, todo[name]))
+                print('%-56s started (worker %d, %s)'%(name, w, devices[w % len(devices)]), flush=True)
+            if not running:
+                # nothing runs and nothing can start: circular dependencies
+                for name in pending:
+                    failed[name] = 'skipped: circular dependencies'
+                break
+            try:
+                name, ok, result, seconds, w = results.get(timeout=1)
+            except queue.Empty:
+                for w, (name, start_time) in list(running.items()):
+                    if not procs[w].is_alive():
+                        del running[w]
+                        failed[name] = 'worker %d exited with code %s'%(w, procs[w].exitcode)
+                        report(name, 'FAILED (worker exited)', time.perf_counter()-start_time, w)
+                        start(w)
+                        idle.append(w)
+                continue
+            del running[w]
+            idle.append(w)
+            if ok:
+                done[name] = result
+                report(name, 'done', seconds, w)
+            else:
+                failed[name] = result
+                report(name, 'FAILED', seconds, w)
+                print(result.strip().splitlines()[-1], flush=True)
+    finally:
+        for w in range(workers):
+            if procs[w].is_alive():
+                tasks[w].put(None)
+        for w in range(workers):
+            procs[w].join(timeout=10)
+            if procs[w].is_alive():
+                procs[w].terminate()
+    print('sweep finished in %.1fs: %d done, %d failed or skipped'%(time.perf_counter()-tic, len(done), len(failed)), flush=True)
+    return {name: done[name] for name in names if name in done}, failed
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Reduced operators
+Representations of the quadratic term of the reduced-order equations
+          R_k = sum_ij A[k,i,j]*lamda_i*lamda_j
+The cubic Galerkin tensor A may carry leading term indices, e.g. Aeqs with the
+shape (4,M,M,M) in the lid driven cavity; they are folded into the output mode
+so that all terms share the same input factors.
+
+Every operator provides
+    quad(lamda): lamda (n,M) -> (n,*lead,M)     the quadratic residual
+    jac(lamda) : lamda (n,M) -> (n,*lead,M,M)   its Jacobian d(quad)/d(lamda)
+written with matmul/reshape only, so that the same kernels run on numpy arrays
+and, after to(device), on torch tensors.
+AffineOperator combines them with the parameter-dependent term coefficients and
+is shared by the POD-G solvers and the losses of CustomedNet.
+"""
+import copy
+import numpy as np
+import torch
+from torch.utils.checkpoint import checkpoint
+
+
+class QuadraticOperator():
+    factors = ()    # float arrays
+    indices = ()    # integer index arrays
+    outfactor = ''  # the factor carrying the output mode, (nterm*M, ...)
+    def Combine(self, c):
+        # sum_t c[n,t]*A[t] for a batch of coefficient vectors c (n,nterm) with
+        # one GEMM on the output factor; the result has the lead shape (n,)
+        X = getattr(self, self.outfactor)
+        nterm = X.shape[0]//self.M
+        new = copy.copy(self)
+        setattr(new, self.outfactor, (c @ X.reshape((nterm, -1))).reshape((-1, X.shape[1])))
+        new.shape = (c.shape[0],) + self.shape[-3:]
+        return new
+
+    def Case(self, i):
+        # the operator of the i-th lead index, e.g. one case after Combine
+        X = getattr(self, self.outfactor)
+        new = copy.copy(self)
+        setattr(new, self.outfactor, X[i*self.M:(i+1)*self.M])
+        new.shape = self.shape[-3:]
+        return new
+
+    def to(self, device):
+        # torch copy of the operator, used by the losses of CustomedNet
+        new = copy.copy(self)
+        for name in self.factors:
+            setattr(new, name, torch.tensor( getattr(self, name) ).float().to(device))
+        for name in self.indices:
+            setattr(new, name, torch.tensor( getattr(self, name) ).long().to(device))
+        return new
+
+
+class SymPackedTensor(QuadraticOperator):
+    """Symmetrized quadratic operator in upper-triangular packed storage
+       Only (A + A^T)/2 over the last two indices contributes to lamda^T A lamda,
+       so for every pair p = (i,j), i<=j, only
+           S[k,p] = A[k,i,j] + A[k,j,i]    (i<j)
+           S[k,p] = A[k,i,i]               (i=j)
+       is stored: M(M+1)/2 instead of M^2 columns, and quad(lamda) is a single
+       matmul of the packed outer product (lamda_i*lamda_j)_p with S^T.
+       The Jacobian (A+A^T)*lamda needs the unpacked symmetric sum; it is
+       gathered from S once, on the first jac of the operator, into
+           J[j, k*M+i] = A[k,i,j] + A[k,j,i]
+       and every later jac (the Newton iterations, the fprime of fsolve) is the
+       single matmul lamda @ J. Combine, Case and to() drop J, their operators
+       gather their own on demand.
+    """
+    factors = ('S', 'w')
+    indices = ('ia', 'ib', 'P')
+    outfactor = 'S'
+    J = None
+    def __init__(self, S, shape):
+        self.shape = tuple(shape)
+        self.M     = self.shape[-1]
+        self.S     = np.asarray(S, dtype=float).reshape((-1, self.M*(self.M+1)//2))
+        self.ia, self.ib = np.triu_indices(self.M)
+        # P[i,j]: packed column of the pair (i,j); w doubles the diagonal
+        self.P = np.zeros((self.M, self.M), dtype=int)
+        self.P[self.ia, self.ib] = np.arange(self.ia.shape[0])
+        self.P[self.ib, self.ia] = np.arange(self.ia.shape[0])
+        self.w = 1 + np.eye(self.M)
+
+    @staticmethod
+    def Pack(A):
+        A = np.asarray(A, dtype=float)
+        M = A.shape[-1]
+        X = A.reshape((-1, M, M, M))
+        ia, ib = np.triu_indices(M)
+        S = X[:,:,ia,ib] + X[:,:,ib,ia]*(ia != ib)
+        return SymPackedTensor(S, A.shape)
+
+    def Combine(self, c):
+        new = super(SymPackedTensor, self).Combine(c)
+        new.J = None
+        return new
+
+    def Case(self, i):
+        new = super(SymPackedTensor, self).Case(i)
+        new.J = None
+        return new
+
+    def to(self, device):
+        new = super(SymPackedTensor, self).to(device)
+        new.J = None
+        return new
+
+    def dense(self):
+        # the symmetric part (A + A^T)/2 over the last two indices
+        X = self.S[:, self.P]*self.w/2
+        return X.reshape(self.shape)
+
+    def Jacobian(self):
+        # J (M, K*M*M) of jac, gathered from S on the first call
+        if self.J is None:
+            X = self.S[:, self.P]*self.w
+            self.J = X.reshape((-1, self.M)).T.copy() if isinstance(X, np.ndarray) \
+                     else X.reshape((-1, self.M)).T.contiguous()
+        return self.J
+
+    def quad(self, lamda):
+        n = lamda.shape[0]
+        q = lamda[:, self.ia]*lamda[:, self.ib]
+        return (q @ self.S.T).reshape((n,) + self.shape[:-3] + (self.M,))
+
+    def jac(self, lamda):
+        n = lamda.shape[0]
+        return (lamda @ self.Jacobian()).reshape((n,) + self.shape[:-3] + (self.M, self.M))
+
+    def __repr__(self):
+        return 'symmetric packed %s, %d stored entries'%(str(self.shape), self.S.shape[0]*self.S.shape[1])
+
+
+class LowRankTensor(QuadraticOperator):
+    """Low-rank compression of the cubic Galerkin tensor
+       method = 'tucker': truncated HOSVD,  A = G x1 U1 x2 U2 x3 U3
+                          cost per sample O(M*(r2+r3) + r1*r2*r3 + K*r1)
+       method = 'cp'    : CP-ALS,           A = sum_r U1[:,r] o U2[:,r] o U3[:,r]
+                          cost per sample O(R*(2M+K))
+       tol is the admissible relative Frobenius error against the dense tensor,
+       the error actually reached is stored in self.error
+    """
+    def __init__(self, A, tol=1E-6, method='tucker', rankmax=None, iterMax=500):
+        A = np.asarray(A, dtype=float)
+        self.shape  = A.shape
+        self.M      = A.shape[-1]
+        self.outfactor = 'U1'
+        self.method = method
+        self.tol    = tol
+        X = A.reshape((-1, self.M, self.M))
+        if method == 'tucker':
+            self.factors = ('U1', 'U2', 'U3', 'G', 'Ga', 'Gb')
+            self.Tucker(X, tol)
+        elif method == 'cp':
+            self.factors = ('U1', 'U2', 'U3')
+            self.CP(X, tol, rankmax or X.shape[0]*self.M, iterMax)
+        else:
+            raise Exception('Unknown compression method: ' + method)
+        normA = np.linalg.norm(A)
+        self.error = np.linalg.norm(self.dense()-A)/normA if normA > 0 else 0.0
+
+    def Tucker(self, X, tol):
+        K, M, _ = X.shape
+        # every mode may discard an equal share of the error budget
+        eps = tol*np.linalg.norm(X)/np.sqrt(3)
+        Unfoldings = (X.reshape((K, M*M)),
+                      X.transpose((1,0,2)).reshape((M, K*M)),
+                      X.transpose((2,0,1)).reshape((M, K*M)),)
+        U = []
+        for Xn in Unfoldings:
+            Un, s, _ = np.linalg.svd(Xn, full_matrices=False)
+            tail = np.sqrt( np.cumsum(s[::-1]**2)[::-1] )   # tail[r] = ||s[r:]||
+            r = max( int((tail > eps).sum()), 1)
+            U.append(Un[:,:r])
+        self.U1, self.U2, self.U3 = U
+        G = np.einsum('kij,ka,ib,jc->abc', X, *U)
+        r1, r2, r3 = G.shape
+        self.rank = G.shape
+        self.G  = G.reshape((r1, r2*r3))
+        self.Ga = G.transpose((1,0,2)).reshape((r2, r1*r3))
+        self.Gb = G.reshape((r1*r2, r3)).T.copy()
+
+    def CP(self, X, tol, rankmax, iterMax):
+        K, M, _ = X.shape
+        normX = np.linalg.norm(X)
+        rng = np.random.RandomState(1234)
+        U1, U2, U3 = np.zeros((K,0)), np.zeros((M,0)), np.zeros((M,0))
+        R = 1
+        while True:
+            # warm start from the previous rank with new random columns
+            dR = R - U1.shape[1]
+            U1 = np.concatenate((U1, rng.randn(K, dR)), axis=1)
+            U2 = np.concatenate((U2, rng.randn(M, dR)), axis=1)
+            U3 = np.concatenate((U3, rng.randn(M, dR)), axis=1)
+            err0 = np.inf
+            for it in range(iterMax):
+                U1 = np.einsum('kij,ir,jr->kr', X, U2, U3) @ np.linalg.pinv( (U2.T@U2)*(U3.T@U3) )
+                U2 = np.einsum('kij,kr,jr->ir', X, U1, U3) @ np.linalg.pinv( (U1.T@U1)*(U3.T@U3) )
+                U3 = np.einsum('kij,kr,ir->jr', X, U1, U2) @ np.linalg.pinv( (U1.T@U1)*(U2.T@U2) )
+                err = np.linalg.norm( X-np.einsum('kr,ir,jr->kij', U1, U2, U3) )/normX
+                if abs(err0-err) < 1E-3*tol:
+                    break
+                err0 = err
+            if err <= tol or R >= rankmax:
+                break
+            R = min( R + max(R//4, 1), rankmax )
+        self.U1, self.U2, self.U3 = U1, U2, U3
+        self.rank = (R,)
+
+    def dense(self):
+        if self.method == 'tucker':
+            G = self.G.reshape(self.rank)
+            X = np.einsum('abc,ka,ib,jc->kij', G, self.U1, self.U2, self.U3)
+        else:
+            X = np.einsum('kr,ir,jr->kij', self.U1, self.U2, self.U3)
+        return X.reshape(self.shape)
+
+    def quad(self, lamda):
+        n = lamda.shape[0]
+        if self.method == 'tucker':
+            a, b = lamda @ self.U2, lamda @ self.U3
+            ab   = (a[:,:,None]*b[:,None,:]).reshape((n, -1))
+            out  = (ab @ self.G.T) @ self.U1.T
+        else:
+            out  = ( (lamda @ self.U2)*(lamda @ self.U3) ) @ self.U1.T
+        return out.reshape((n,) + self.shape[:-3] + (self.M,))
+
+    def jac(self, lamda):
+        n = lamda.shape[0]
+        if self.method == 'tucker':
+            r1 = self.rank[0]
+            a, b = lamda @ self.U2, lamda @ self.U3
+            J = (b @ self.Gb).reshape((n, r1, -1)) @ self.U2.T \
+               +(a @ self.Ga).reshape((n, r1, -1)) @ self.U3.T
+            J = self.U1 @ J
+        else:
+            a, b = lamda @ self.U2, lamda @ self.U3
+            J = (self.U1[None,:,:]*b[:,None,:]) @ self.U2.T \
+               +(self.U1[None,:,:]*a[:,None,:]) @ self.U3.T
+        return J.reshape((n,) + self.shape[:-3] + (self.M, self.M))
+
+    def __repr__(self):
+        return '%s rank %s, relative error %e'%(self.method, str(self.rank), self.error)
+
+
+class AffineOperator():
+    """Reduced operator depending affinely on the term coefficients
+           R(lamda) = sum_t cA_t*quad_t(lamda) + sum_t cB_t*B_t*lamda + sum_t cB_t*f_t
+       cA (n,nA) weights the quadratic terms held by Aop (packed or low-rank),
+       cB (n,nB) weights the linear terms B_t and the constant terms f_t, which
+       are stored flattened as (nB, M^2) and (nB, M).
+       Assemble builds the operators of a whole batch of cases with one GEMM per
+       part; residual contracts the coefficients with quad(lamda) and with
+       lamda*B_t^T, i.e. (n,nA,M) and (n,nB,M) intermediates, and never forms
+       a per-case operator.
+    """
+    def __init__(self, Aop, B, f):
+        self.Aop = Aop
+        self.M   = Aop.M
+        self.B   = np.asarray(B, dtype=float).reshape((-1, self.M*self.M))
+        self.f   = np.asarray(f, dtype=float).reshape((-1, self.M))
+        # BT[j, t*M+k] = B_t[k,j], so that lamda @ BT stacks all B_t*lamda
+        self.BT  = self.B.reshape((-1, self.M, self.M)).transpose((2,0,1)).reshape((self.M, -1))
+
+    def Assemble(self, cA, cB):
+        n  = cA.shape[0]
+        A  = self.Aop.Combine(cA)
+        B  = (cB @ self.B).reshape((n, self.M, self.M))
+        f  = cB @ self.f
+        return A, B, f
+
+    def residual(self, lamda, cA, cB, chunk=None):
+        # chunk: evaluate at most chunk cases at once; with autograd the chunks
+        # are checkpointed, so only their inputs are kept for the backward pass
+        n = lamda.shape[0]
+        if chunk is None or n <= chunk:
+            return self._residual(lamda, cA, cB)
+        if isinstance(lamda, np.ndarray):
+            return np.concatenate([self._residual(lamda[i:i+chunk], cA[i:i+chunk], cB[i:i+chunk]) \
+                                   for i in range(0, n, chunk)])
+        fun = self._residual
+        if torch.is_grad_enabled():
+            fun = lambda *args: checkpoint(self._residual, *args, use_reentrant=False)
+        return torch.cat([fun(lamda[i:i+chunk], cA[i:i+chunk], cB[i:i+chunk]) for i in range(0, n, chunk)])
+
+    def _residual(self, lamda, cA, cB):
+        n  = lamda.shape[0]
+        fx = cA[:,None,:] @ self.Aop.quad(lamda).reshape((n, -1, self.M))
+        fx = fx + cB[:,None,:] @ (lamda @ self.BT).reshape((n, -1, self.M))
+        return fx.reshape((n, self.M)) + cB @ self.f
+
+    def to(self, device):
+        new = copy.copy(self)
+        new.Aop = self.Aop.to(device)
+        new.B   = torch.tensor(self.B).float().to(device)
+        new.BT  = torch.tensor(self.BT).float().to(device)
+        new.f   = torch.tensor(self.f).float().to(device)
+        return new
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+@Samplers of the design space
+Space-filling alternatives to the random residual points and to the full
+tensor grids of UniformSamples, whose size grows as Nlevel^nvars:
+    sobol   :: scrambled Sobol sequence
+    halton  :: scrambled Halton sequence
+    lhs     :: Latin hypercube
+    random  :: uniform random points, np.random.rand
+    smolyak :: Smolyak sparse grid of nested Clenshaw-Curtis points of the
+               level given (1: the center, 2: 2*nvars+1 points, ...), by
+               default the highest level with at most N points
+The points are generated in [-1,1]^nvars and mapped to the design space with
+Normalization.Anti_Mapminmax. The random methods draw their seeds from
+np.random, so np.random.seed makes them reproducible.
+"""
+import warnings
+import numpy as np
+from scipy.stats import qmc
+from Normalization import Normalization
+from UniformSamples import WriteSamples
+
+METHODS = ('sobol', 'halton', 'lhs', 'random', 'smolyak')
+
+def Samples(design_space, N, method='random', file=None, level=None):
+    nvars = design_space.shape[1]
+    if method == 'smolyak':
+        xgrids = Smolyak(nvars, level or SmolyakLevel(nvars, N))
+    elif method == 'random':
+        xgrids = np.random.rand(N, nvars)*2-1
+    elif method in ('sobol', 'halton', 'lhs'):
+        seed = np.random.randint(2**31)
+        engine = {'sobol' : lambda: qmc.Sobol(nvars, scramble=True, seed=seed),
+                  'halton': lambda: qmc.Halton(nvars, scramble=True, seed=seed),
+                  'lhs'   : lambda: qmc.LatinHypercube(nvars, seed=seed),}[method]()
+        with warnings.catch_warnings():
+            # Sobol points are best balanced for N = 2^m, but any N is valid
+            warnings.simplefilter('ignore', UserWarning)
+            xgrids = engine.random(N)*2-1
+    else:
+        raise Exception('Unknown sampling method: ' + method)
+    Samples = Normalization.Anti_Mapminmax(xgrids, design_space)
+    if file:
+        WriteSamples(Samples, design_space, file)
+    return Samples
+
+def ClenshawCurtis(i):
+    # nested 1D points of the level i: 1, 3, 5, 9, 17, ... points in [-1,1]
+    if i == 1:
+        return np.zeros(1)
+    m = 2**(i-1) + 1
+    return -np.cos(np.pi*np.arange(m)/(m-1))
+
+def SmolyakLevel(nvars, N):
+    # the highest level of a Smolyak grid with at most N points, at least 1
+    level = 1
+    while Smolyak(nvars, level+1).shape[0] <= N:
+        level += 1
+    return level
+
+def Smolyak(nvars, level):
+    # union of the tensor grids of the levels (i_1..i_nvars), i_k >= 1 and
+    # sum(i) <= level + nvars - 1; the 1D points are nested, so the union
+    # equals the Smolyak grid
+    if int(level) != level or level < 1:
+        raise Exception('Smolyak level must be a positive integer, got %s'%str(level))
+    points = []
+    def levels(k, budget):
+        if k == 0:
+            yield ()
+            return
+        for i in range(1, budget+1):
+            for rest in levels(k-1, budget-i+1):
+                yield (i,) + rest
+    for index in levels(nvars, level):
+        grids = np.meshgrid(*(ClenshawCurtis(i) for i in index))
+        points.append( np.stack(grids, axis=nvars).reshape((-1, nvars)) )
+    points = np.round(np.concatenate(points), 14) + 0.0
+    return np.unique(points, axis=0)
+
+if __name__ == "__main__":
+    # Natural Convection: Ra, Pr, Theta
+    design_space =np.array([[1E4, 0.6, 45],[1E5,0.8,90]])
+    for level in range(1, 6):
+        print('smolyak level %d: %d points, tensor grid %d points'%(level, Smolyak(3, level).shape[0], \
+              ClenshawCurtis(level).shape[0]**3))
+    np.random.seed(1234)
+    file ="./NaturalConvectionValidationSobol.txt"
+    Samples(design_space, 128, 'sobol', file)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Solver telemetry
+Per-case records and aggregate timers of the POD-G solvers (POD_G, POD_Gfsolve).
+    records  : structured array, one entry per case
+               iterations :: Newton iterations, -1 for fsolve, which does not
+                             report its iterations
+               nfev       :: residual evaluations of fsolve, -1 for Newton
+               residual   :: norm of the final residual
+               walltime   :: seconds spent on the case
+               initdist   :: ||lamda0 - lamda||/||lamda|| of the initial guess
+               converged  :: whether the residual reached the tolerance
+    timers   : accumulated seconds per phase (assemble, solve, ...)
+"""
+import time
+from contextlib import contextmanager
+import numpy as np
+
+RECORD = np.dtype([('iterations', 'i8'),
+                   ('nfev',       'i8'),
+                   ('residual',   'f8'),
+                   ('walltime',   'f8'),
+                   ('initdist',   'f8'),
+                   ('converged',  '?' ),])
+
+class SolverStats():
+    def __init__(self, n, name='POD-G'):
+        self.name    = name
+        self.records = np.zeros(n, dtype=RECORD)
+        self.timers  = {}
+
+    @contextmanager
+    def timer(self, phase):
+        tic = time.perf_counter()
+        yield
+        self.timers[phase] = self.timers.get(phase, 0.0) + time.perf_counter() - tic
+
+    def record(self, i, iterations, residual, walltime, lamda0, lamda, converged, nfev=-1):
+        norm = np.linalg.norm(lamda)
+        initdist = np.linalg.norm(lamda0-lamda)/norm if norm > 0 else np.linalg.norm(lamda0)
+        self.records[i] = (iterations, nfev, residual, walltime, initdist, converged)
+
+    def summary(self, nslow=3):
+        r = self.records
+        lines = ['%s: %d cases, %d converged, %.3fs in total (%s)'%(self.name, r.shape[0], \
+                 r['converged'].sum(), sum(self.timers.values()), \
+                 ', '.join('%s %.3fs'%(key, val) for key, val in self.timers.items()))]
+        if r.shape[0] == 0:
+            return lines[0]
+        # iterations of Newton, function evaluations of fsolve: not comparable
+        count = 'iterations' if r['iterations'].max() >= 0 else 'nfev'
+        unit  = {'iterations': 'it', 'nfev': 'nfev'}[count]
+        lines.append('    %s mean/max = %.1f/%d, residual max = %.3e, walltime mean/max = %.4f/%.4fs'\
+                     %(count, r[count].mean(), r[count].max(), r['residual'].max(), \
+                       r['walltime'].mean(), r['walltime'].max()))
+        slow = np.argsort(r['walltime'])[::-1][:nslow]
+        lines.append('    slowest cases: ' + ', '.join('%d (%.4fs, %d %s, initdist %.2e)'\
+                     %(i, r['walltime'][i], r[count][i], unit, r['initdist'][i]) for i in slow))
+        failed = np.where(~r['converged'])[0]
+        if failed.shape[0] > 0:
+            lines.append('    not converged: ' + ', '.join('%d'%i for i in failed))
+        return '\n'.join(lines)
@@ -6,6 +6,23 @@ Created on Mon Apr 27 21:57:50 2020
 """
 import numpy as np
 
+def WriteSamples(Samples, design_space, file):
+    # input file of the solvers: number of samples, bounds and the samples
+    lb = design_space[0:1,:]
+    ub = design_space[1:2,:]
+    nvars = design_space.shape[1]
+    with open(file, 'w') as f:
+        f.write("#the number of samples\n")
+        f.write('%d\n'%Samples.shape[0]);
+        formatstr = '%14.7e\t'*nvars + "\n"
+        f.write('#lower bound\n');
+        f.write(formatstr%tuple(lb[0,:]));
+        f.write('#upper bound\n');
+        f.write(formatstr%tuple(ub[0,:]));
+        formatstr = '%d\t'+'%14.7e\t'*nvars+"\n"
+        for i in range(Samples.shape[0]):
+            f.write(formatstr%(i+1,*tuple(Samples[i,:]),));
+
 def UniformSamples(design_space,Nlevel,file):
     lb = design_space[0:1,:]
     ub = design_space[1:2,:]
@@ -16,17 +33,7 @@ def UniformSamples(design_space,Nlevel,file):
     Samples= (ub+lb)/2 +xgrids*(ub-lb)/2
     
     if file:
-        with open(file, 'w') as f:
-            f.write("#the number of samples\n")
-            f.write('%d\n'%Samples.shape[0]);
-            formatstr = '%14.7e\t'*nvars + "\n"
-            f.write('#lower bound\n');
-            f.write(formatstr%tuple(lb[0,:]));
-            f.write('#upper bound\n');
-            f.write(formatstr%tuple(ub[0,:]));
-            formatstr = '%d\t'+'%14.7e\t'*nvars+"\n"
-            for i in range(Samples.shape[0]):
-                f.write(formatstr%(i+1,*tuple(Samples[i,:]),));
+        WriteSamples(Samples, design_space, file)
     return Samples
 
 if __name__ == "__main__":